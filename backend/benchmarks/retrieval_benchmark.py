@@ -0,0 +1,254 @@
+"""Retrieval quality and latency benchmark.
+
+Runs the labeled queries in data/retrieval_queries.json through retrieve_docs
+and reports recall@k, MRR and p50/p95/p99 latency per retrieval type. Results
+are written as JSON (tagged with the git commit) to track regressions.
+
+By default everything runs locally: the stub embedding server stands in for
+the embedding service, and the manim repo in MANIM_DIR is chunked with the
+ingestion chunkers into an in-process numpy index. Use --embedding-url for the
+real embedding service, and --backend postgres for a pgvector database
+(e.g. a local pgvector/pgvector container) configured through POSTGRES_*.
+--dimensions embeds with a smaller Matryoshka output size, to find the
+smallest one that keeps recall.
+
+    python -m backend.benchmarks.retrieval_benchmark --k 3 --repeat 3
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import time
+
+from backend.workflow.utils.logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+QUERIES_PATH = os.path.join(os.path.dirname(__file__), "data", "retrieval_queries.json")
+EMBED_BATCH_SIZE = 32
+
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def _percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def _is_relevant(doc, case: dict) -> bool:
+    """A document is relevant if it comes from an expected file or mentions an
+    expected symbol in its content or ref_* metadata"""
+    if doc.metadata.get("filename") in case.get("files", []):
+        return True
+    refs = " ".join(
+        doc.metadata.get(key, "") for key in ("ref_classes", "ref_functions")
+    )
+    words = set(_WORD.findall(doc.page_content)) | set(refs.split())
+    return any(symbol in words for symbol in case.get("symbols", []))
+
+
+async def build_local_index(manim_dir: str, path: str):
+    """Chunks the manim repo with the ingestion chunkers, embeds the chunks
+    through the configured embedding service and writes a numpy index"""
+    from backend.workflow.utils.HFSpace.hf_space_wrapper import CustomEmbedding
+    from backend.workflow.utils.ingest_docs import (
+        _get_all_documents,
+        _get_ingest_files,
+    )
+    from backend.workflow.utils.vector_index import write_vector_index
+
+    documents = []
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        future_to_file = {
+            executor.submit(_get_all_documents, file): file
+            for file in _get_ingest_files(manim_dir)
+        }
+        for future in concurrent.futures.as_completed(future_to_file):
+            try:
+                documents.extend(future.result())
+            except Exception as exc:
+                logger.warning(f"Skipping {future_to_file[future]!r}: {exc!r}")
+    logger.info(f"Chunked corpus into {len(documents)} documents")
+
+    embed_service = CustomEmbedding()
+    rows = []
+    for i in range(0, len(documents), EMBED_BATCH_SIZE):
+        batch = documents[i : i + EMBED_BATCH_SIZE]
+        embeddings = await embed_service.embed_documents(
+            [doc.page_content for doc in batch]
+        )
+        if len(embeddings) != len(batch):
+            raise RuntimeError(f"Embedding failed for documents {i}-{i + len(batch)}")
+        rows += [
+            (embedding, doc.page_content, doc.metadata)
+            for embedding, doc in zip(embeddings, batch)
+        ]
+    write_vector_index(path, rows)
+
+
+def _clear_caches():
+    from backend.workflow.utils.cache import get_embedding_cache, get_retrieval_cache
+
+    get_embedding_cache().local.clear()
+    get_retrieval_cache().clear()
+
+
+async def run_queries(cases: list[dict], k: int, repeat: int, warm: bool):
+    from backend.workflow.utils.retrieve import retrieve_docs
+
+    type_to_arg = {"code": "k_code", "documentation": "k_doc", "summary": "k_summary"}
+    per_query = []
+    for case in cases:
+        kwargs = {"k_code": 0, "k_doc": 0, "k_summary": 0, type_to_arg[case["type"]]: k}
+        latencies = []
+        docs = []
+        for _ in range(repeat):
+            if not warm:
+                _clear_caches()
+            start = time.perf_counter()
+            docs = await retrieve_docs(case["query"], **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        rank = next(
+            (i for i, (doc, _) in enumerate(docs, 1) if _is_relevant(doc, case)), None
+        )
+        per_query.append(
+            {
+                "query": case["query"],
+                "type": case["type"],
+                "rank": rank,
+                "latencies_ms": latencies,
+            }
+        )
+    return per_query
+
+
+def summarize(per_query: list[dict]) -> dict:
+    summary = {}
+    for type in sorted({q["type"] for q in per_query}):
+        results = [q for q in per_query if q["type"] == type]
+        latencies = [ms for q in results for ms in q["latencies_ms"]]
+        summary[type] = {
+            "queries": len(results),
+            "recall_at_k": sum(q["rank"] is not None for q in results) / len(results),
+            "mrr": sum(1 / q["rank"] for q in results if q["rank"]) / len(results),
+            "p50_ms": _percentile(latencies, 0.50),
+            "p95_ms": _percentile(latencies, 0.95),
+            "p99_ms": _percentile(latencies, 0.99),
+        }
+    return summary
+
+
+async def main(args):
+    from backend.benchmarks.stub_embedding_server import start_stub_server
+    from backend.workflow.utils import vector_index
+    from backend.workflow.utils.HFSpace import hf_space_wrapper
+    from backend.workflow.utils.http_client import close_http_session
+
+    runner = None
+    hf_space_wrapper.EMBEDDING_DIMENSIONS = args.dimensions
+    if args.embedding_url:
+        hf_space_wrapper.EMBEDDING_URL = args.embedding_url
+    else:
+        runner, url = await start_stub_server()
+        hf_space_wrapper.EMBEDDING_URL = url
+        logger.info(f"Started stub embedding server at {url}")
+
+    with open(args.queries) as f:
+        cases = json.load(f)
+
+    if args.backend == "numpy" and not args.manim_dir:
+        raise SystemExit("--manim-dir (or MANIM_DIR) is required for the numpy backend")
+
+    try:
+        with tempfile.TemporaryDirectory() as index_dir:
+            if args.backend == "numpy":
+                await build_local_index(args.manim_dir, index_dir)
+                vector_index.RETRIEVAL_BACKEND = "numpy"
+                vector_index.VECTOR_INDEX_DIR = index_dir
+            else:
+                vector_index.RETRIEVAL_BACKEND = "postgres"
+            per_query = await run_queries(cases, args.k, args.repeat, args.warm)
+    finally:
+        await close_http_session()
+        if runner is not None:
+            await runner.cleanup()
+        if args.backend == "postgres":
+            from backend.workflow.utils.pg_engine import close_pg_engine
+
+            await close_pg_engine()
+
+    results = {
+        "commit": _git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {
+            "backend": args.backend,
+            "embedding": args.embedding_url or "stub",
+            "dimensions": args.dimensions,
+            "k": args.k,
+            "repeat": args.repeat,
+            "warm": args.warm,
+        },
+        "types": summarize(per_query),
+        "queries": per_query,
+    }
+
+    suffix = f"-d{args.dimensions}" if args.dimensions else ""
+    output = args.output or os.path.join(
+        "benchmark_results", f"retrieval-{results['commit']}{suffix}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    header = ("type", "n", "recall@k", "mrr", "p50", "p95", "p99")
+    print("{:<15}{:>4}{:>10}{:>8}{:>9}{:>9}{:>9}".format(*header))
+    for type, s in results["types"].items():
+        print(
+            f"{type:<15}{s['queries']:>4}{s['recall_at_k']:>10.3f}{s['mrr']:>8.3f}"
+            f"{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}"
+        )
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--manim-dir", default=os.getenv("MANIM_DIR"))
+    parser.add_argument("--backend", choices=["numpy", "postgres"], default="numpy")
+    parser.add_argument(
+        "--embedding-url", help="embedding service to use instead of the stub"
+    )
+    parser.add_argument(
+        "--dimensions", type=int, help="Matryoshka embedding size (default: full)"
+    )
+    parser.add_argument("--queries", default=QUERIES_PATH)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--warm", action="store_true", help="keep caches between repetitions"
+    )
+    parser.add_argument("--output", help="defaults to benchmark_results/")
+
+    configure_logging()
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,77 @@
+"""Deterministic stand-in for the embedding service (/v1/embeddings).
+
+Embeds text as a normalized hashed bag of words and character trigrams, so
+benchmarks run offline and their results only change when retrieval or
+chunking changes. Not a semantic model: compare runs against each other, not
+against recall of the real model.
+"""
+
+import base64
+import hashlib
+import math
+import re
+import struct
+
+from aiohttp import web
+
+VECTOR_SIZE = 1024
+
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def _features(text: str):
+    for word in _WORD.findall(text):
+        yield word.lower(), 1.0
+        padded = f"#{word.lower()}#"
+        for i in range(len(padded) - 2):
+            yield padded[i : i + 3], 0.25
+
+
+def stub_embedding(text: str, dimensions: int = VECTOR_SIZE) -> list[float]:
+    # the instruct template of query embeddings is the same for every query
+    text = text.split("\nQuery:", 1)[-1]
+    vector = [0.0] * dimensions
+    for feature, weight in _features(text):
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        idx = int.from_bytes(digest[:4], "little") % dimensions
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vector[idx] += sign * weight
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _encode(embedding: list[float], body: dict):
+    if body.get("encoding_format") != "base64":
+        return embedding
+    typecode = "e" if body.get("embedding_dtype") == "float16" else "f"
+    packed = struct.pack(f"<{len(embedding)}{typecode}", *embedding)
+    return base64.b64encode(packed).decode("ascii")
+
+
+async def create_embeddings(request: web.Request):
+    body = await request.json()
+    texts = [body["input"]] if isinstance(body["input"], str) else body["input"]
+    dimensions = body.get("dimensions") or VECTOR_SIZE
+    data = [
+        {
+            "object": "embedding",
+            "embedding": _encode(stub_embedding(t, dimensions), body),
+            "index": i,
+        }
+        for i, t in enumerate(texts)
+    ]
+    return web.json_response(
+        {"object": "list", "data": data, "model": body.get("model"), "usage": {}}
+    )
+
+
+async def start_stub_server(host="127.0.0.1", port=0):
+    """Starts the stub on the running loop, returns (runner, embeddings url)"""
+    app = web.Application(client_max_size=64 * 2**20)
+    app.router.add_post("/v1/embeddings", create_embeddings)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}/v1/embeddings"
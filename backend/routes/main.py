@@ -3,6 +3,7 @@ import datetime
 import json
 import logging
 import os
+from contextlib import asynccontextmanager
 from enum import Enum
 from typing import Optional
 
@@ -15,7 +16,17 @@ from sse_starlette.sse import EventSourceResponse
 
 from backend.workflow.graph import graph
 from backend.workflow.models.state import State
+from backend.workflow.utils import metrics
+from backend.workflow.utils.HFSpace.hf_space_wrapper import (
+    EMBEDDING_BACKEND,
+    CustomEmbedding,
+)
+from backend.workflow.utils.http_client import close_http_session, start_http_session
+from backend.workflow.utils.local_embedding import load_local_model
 from backend.workflow.utils.logging_config import configure_logging
+from backend.workflow.utils.pg_engine import close_pg_engine, init_pg_engine
+from backend.workflow.utils.pg_indexes import VECTOR_SIZE
+from backend.workflow.utils.resilience import deadline
 
 configure_logging()
 logger = logging.getLogger(__name__)
@@ -25,7 +36,21 @@ origins = [FRONTEND_URL]
 
 logger.info(f"Added origins to the CORS: {origins}")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_pg_engine()
+    # importing pg_indexes already rejected a VECTOR_SIZE/EMBEDDING_DIMENSIONS mismatch
+    logger.info(f"Stored vector size: {VECTOR_SIZE}")
+    await start_http_session()
+    if EMBEDDING_BACKEND == "local":
+        await load_local_model(CustomEmbedding().model)
+    yield
+    await close_http_session()
+    await close_pg_engine()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -35,6 +60,8 @@ app.add_middleware(
 )
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Budget of a job, outbound calls made by the workflow stop retrying past it
+JOB_TIMEOUT = int(os.getenv("JOB_TIMEOUT", str(60 * 45)))
 r = redis.from_url(REDIS_URL, decode_responses=True)
 
 
@@ -62,7 +89,8 @@ async def _run_graph_and_store(uuid: str, query: str):
     state_input = {"uuid": uuid, "query": query}
     state = State(**state_input)
     logger.info(f"Started workflow for uuid: {uuid} - query: {query}")
-    result_state = await graph.ainvoke(state, config={"recursion_limit": 150})
+    with deadline(JOB_TIMEOUT):
+        result_state = await graph.ainvoke(state, config={"recursion_limit": 150})
     if result_state.get("error_message"):
         logger.error(
             f"Error occurred in the workflow for uuid: {uuid} "
@@ -109,7 +137,9 @@ async def run_workflow(request: Request, background_tasks: BackgroundTasks):
     return JobResultResponse(uuid=request.uuid, status=JobStatus.PENDING)
 
 
-async def _wait_for_final_status(uuid: str, poll_interval: float = 5, timeout=60 * 45):
+async def _wait_for_final_status(
+    uuid: str, poll_interval: float = 5, timeout=JOB_TIMEOUT
+):
     """Poll Redis until the job reaches a terminal state."""
     now = datetime.datetime.now()
     maxt = datetime.timedelta(seconds=timeout) + now
@@ -184,6 +214,12 @@ async def get_result(uuid: str):
     )
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """In-process counters and latency summaries of this worker"""
+    return metrics.snapshot()
+
+
 @app.get("/")
 async def root():
     """API documentation endpoint"""
@@ -194,6 +230,7 @@ async def root():
             "GET /status/{uuid}": "Check job status",
             "GET /result/{uuid}": "Get result for the job uuid (supports long polling)",
             "GET /events/{uuid}": "SSE stream that emits event when job finishes",
+            "GET /metrics": "Counters and latency summaries of this worker",
         },
     }
 
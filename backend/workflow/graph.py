@@ -12,6 +12,10 @@ from backend.workflow.nodes.evaluator import evaluator_agent
 from backend.workflow.nodes.query_decomposer import query_decomposer
 from backend.workflow.nodes.reasoning_agent import reasoning_agent
 from backend.workflow.nodes.render_and_upload import render_and_upload
+from backend.workflow.nodes.retrieval_prefetch import (
+    prefetched_context,
+    retrieval_prefetch,
+)
 from backend.workflow.nodes.retriever import retriever
 from backend.workflow.nodes.sql_uploader import sql_uploader
 
@@ -45,7 +49,9 @@ def evaluator_agent_route(
 workflow = StateGraph(State)
 
 workflow.add_node("reasoning_agent", reasoning_agent)
+workflow.add_node("retrieval_prefetch", retrieval_prefetch)
 workflow.add_node("query_decomposer", query_decomposer)
+workflow.add_node("prefetched_context", prefetched_context)
 # workflow.add_node("retriever", retriever)
 workflow.add_node("coding_agent", coding_agent)
 workflow.add_node("evaluator_agent", evaluator_agent)
@@ -54,11 +60,13 @@ workflow.add_node("sql_uploader", sql_uploader)
 
 workflow.add_edge(START, "reasoning_agent")
 workflow.add_conditional_edges(
-    "reasoning_agent", route_on_error, {"END": END, "continue": "query_decomposer"}
+    "reasoning_agent", route_on_error, {"END": END, "continue": "retrieval_prefetch"}
 )
+workflow.add_edge("retrieval_prefetch", "query_decomposer")
 workflow.add_conditional_edges(
-    "query_decomposer", route_on_error, {"END": END, "continue": "coding_agent"}
+    "query_decomposer", route_on_error, {"END": END, "continue": "prefetched_context"}
 )
+workflow.add_edge("prefetched_context", "coding_agent")
 # workflow.add_conditional_edges(
 #     "query_decomposer", route_on_error, {"END": END, "continue": "retriever"}
 # )
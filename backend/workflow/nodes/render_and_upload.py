@@ -1,10 +1,8 @@
-import asyncio
 import logging
 import uuid
 
-import aiohttp
-
 from backend.workflow.models.state import State
+from backend.workflow.utils.http_client import request_json
 
 logger = logging.getLogger(__name__)
 
@@ -15,9 +13,9 @@ async def render_and_upload(state: State):
     job_uuid = str(uuid.uuid4())
     logger.info("Render and upload:")
     try:
-        await _make_async_post_request(
-            url=f"{RENDER_URL}/trigger-rendering",
-            headers=None,
+        await request_json(
+            "POST",
+            f"{RENDER_URL}/trigger-rendering",
             payload={
                 "uuid": job_uuid,
                 "code": state.code_generated,
@@ -27,9 +25,11 @@ async def render_and_upload(state: State):
         logger.info("Triggered rendering process")
 
         # wait upto 15 mins for completion
-        result = await _make_async_get_request(
-            url=f"{RENDER_URL}/render-result/{job_uuid}",
+        result = await request_json(
+            "GET",
+            f"{RENDER_URL}/render-result/{job_uuid}",
             params={"wait": "true", "timeout": 900},
+            read_timeout=960,
         )
         logger.info("Done rendering and uploading")
     except Exception as e:
@@ -44,33 +44,3 @@ async def render_and_upload(state: State):
         "created_at": result["created_at"],
         "completed_at": result.get("completed_at"),
     }
-
-
-async def _make_async_post_request(url, headers, payload, max_retries=3):
-    for i in range(max_retries):
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, json=payload, headers=headers) as response:
-                    response.raise_for_status()
-                    resp = await response.json()
-                    return resp
-            except Exception as e:
-                logger.warning(f"Error during POST request: {e}")
-                await asyncio.sleep(10)
-                if i == max_retries - 1:
-                    raise e
-
-
-async def _make_async_get_request(url, params, max_retries=3):
-    for i in range(max_retries):
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(url, params=params) as response:
-                    response.raise_for_status()
-                    resp = await response.json()
-                    return resp
-            except Exception as e:
-                logger.warning(f"Error during GET request: {e}")
-                await asyncio.sleep(10)
-                if i == max_retries - 1:
-                    raise e
@@ -0,0 +1,28 @@
+import logging
+
+from backend.workflow.models.state import State
+from backend.workflow.utils.prefetch import (
+    RETRIEVAL_PREFETCH,
+    prefetched_docs,
+    schedule_prefetch,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def retrieval_prefetch(state: State):
+    """Starts retrieving the documents of all planned steps in the background,
+    doesn't wait for it and doesn't modify the state"""
+    if RETRIEVAL_PREFETCH and state.steps:
+        logger.info("Retrieval Prefetch:")
+        schedule_prefetch(state.uuid, [step.description for step in state.steps])
+    return {}
+
+
+async def prefetched_context(state: State):
+    """Hands the prefetched documents of the current step to the coding agent"""
+    if not RETRIEVAL_PREFETCH:
+        return {}
+    docs = await prefetched_docs(state.uuid, state.completed_steps)
+    logger.info(f"Prefetched context for step {state.completed_steps + 1}")
+    return {"formatted_docs": docs}
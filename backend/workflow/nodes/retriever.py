@@ -1,7 +1,7 @@
 import logging
 
 from backend.workflow.models.state import State
-from backend.workflow.utils.retrieve import format_retrieved_docs, retrieve_docs
+from backend.workflow.utils.retrieve import format_retrieved_docs, retrieve_docs_batch
 
 logger = logging.getLogger(__name__)
 
@@ -13,11 +13,14 @@ async def retriever(state: State):
     logger.info("Retriever: ")
     err = None
     try:
-        code_docs = await retrieve_docs(code_prompt, k_doc=0, k_summary=0)
-        documentation_docs = await retrieve_docs(
-            documentation_prompt, k_code=0, k_summary=0
+        # one embedding request for all three prompts, searches run concurrently
+        code_docs, documentation_docs, summary_docs = await retrieve_docs_batch(
+            [
+                (code_prompt, {"code": 2}),
+                (documentation_prompt, {"documentation": 1}),
+                (summary_prompt, {"summary": 1}),
+            ]
         )
-        summary_docs = await retrieve_docs(summary_prompt, k_code=0, k_doc=0)
     except Exception as e:
         err = repr(e)
     if err is not None:
@@ -1,6 +1,7 @@
 from langchain.tools import tool
 
 from backend.workflow.utils.retrieve import format_retrieved_docs, retrieve_docs
+from backend.workflow.utils.symbol_index import is_symbol_query, lookup_symbols
 
 
 @tool
@@ -35,5 +36,12 @@ async def fetch_summary(query: str, limit: int = 3):
         query: Search terms to look for the specific API
         limit: Maximum number of langchain Document objects(chunks) to return
     """
-    docs = await retrieve_docs(query, k_code=0, k_doc=0, k_summary=limit)
-    return format_retrieved_docs(docs)
+    docs = await lookup_symbols(query, limit)
+    # a bare class/function name is answered without an embedding call
+    if docs and is_symbol_query(query):
+        return format_retrieved_docs(docs)
+    vector_docs = await retrieve_docs(query, k_code=0, k_doc=0, k_summary=limit)
+    # exact symbol hits first, the vector results fill up to `limit`
+    contents = {doc.page_content for doc, _ in docs}
+    docs += [d for d in vector_docs if d[0].page_content not in contents]
+    return format_retrieved_docs(docs[:limit])
@@ -1,105 +1,164 @@
 import asyncio
+import base64
 import json
 import logging
 import os
 
-import aiohttp
+import numpy as np
 from dotenv import load_dotenv
 from langchain.embeddings import Embeddings
 
+from backend.workflow.utils.cache import get_embedding_cache
+from backend.workflow.utils.embedding_batcher import (
+    EMBEDDING_BATCH_WINDOW_MS,
+    get_embedding_batcher,
+)
+from backend.workflow.utils.http_client import (
+    get_http_session,
+    request_json,
+    request_timeout,
+)
+from backend.workflow.utils.local_embedding import (
+    LOCAL_EMBEDDING_MODEL,
+    create_local_embeddings,
+)
+from backend.workflow.utils.resilience import call_with_retry
+
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 HF_TOKEN = os.getenv("HF_TOKEN")
-
-
-async def _make_async_post_request(url, headers, payload, max_retries=3):
-    for i in range(max_retries):
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, json=payload, headers=headers) as response:
-                    response.raise_for_status()
-                    resp = await response.json()
-                    return resp
-            except Exception as e:
-                logger.exception(f"Error during POST request: {e}")
-                await asyncio.sleep(1)
-                if i == max_retries - 1:
-                    raise e
-
-
-async def _make_async_get_request(url, headers, params=None, max_retries=5):
-    for i in range(max_retries):
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(url, headers=headers, params=params) as response:
-                    response.raise_for_status()
-                    resp = await response.json()
-                    return resp
-            except Exception as e:
-                logger.warning(f"Error during GET request: {e}")
-                await asyncio.sleep(2**max_retries)
-                if i == max_retries - 1:
-                    raise e
-
-
-async def _make_async_get_sse(url, headers, params=None, max_retries=3, timeout=30):
-    for i in range(max_retries):
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, params=params) as response:
-                    response.raise_for_status()
-                    event_name: str | None = None
-                    data_chunks: list[str] = []
-                    async for line_bytes in response.content:
-                        line = line_bytes.decode().strip()
-                        if line == "":
-                            if event_name and data_chunks:
-                                # Join all ``data:`` lines (the spec allows multi‑line data)
-                                raw_data = "\n".join(data_chunks)
-                                try:
-                                    return json.loads(raw_data)
-                                except json.JSONDecodeError as exc:
-                                    raise ValueError(
-                                        f"Failed to decode SSE data as JSON: {raw_data!r}"
-                                    ) from exc
-                            event_name, data_chunks = None, []
-
-                        if line.startswith("event:"):
-                            event_name = line.partition(":")[2].strip()
-                        elif line.startswith("data:"):
-                            data_chunks.append(line.partition(":")[2].strip())
-        except Exception as e:
-            logger.warning(f"Error during GET request: {e}")
-            await asyncio.sleep(1)
-            if i == max_retries - 1:
-                raise e
+EMBEDDING_URL = os.getenv(
+    "EMBEDDING_URL", "https://msvelan-code-embedding-model.hf.space/v1/embeddings"
+)
+# "base64" (packed floats) or "float" (JSON lists) responses from the service
+EMBEDDING_ENCODING_FORMAT = os.getenv("EMBEDDING_ENCODING_FORMAT", "base64")
+# float32 or float16 (half the payload, ~1e-3 precision) base64 embeddings
+EMBEDDING_TRANSPORT_DTYPE = os.getenv("EMBEDDING_TRANSPORT_DTYPE", "float32")
+# "remote" (the embedding service at EMBEDDING_URL) or "local" (in-process)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "remote")
+# Matryoshka output size (truncated and renormalized), empty for the model's
+# full size. Stored vectors must have the same size (VECTOR_SIZE).
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS") or 0) or None
+
+
+async def _make_async_get_sse(url, headers, params=None, timeout=30):
+    session = get_http_session()
+
+    async def _read_event():
+        async with session.get(
+            url, headers=headers, params=params, timeout=request_timeout(timeout)
+        ) as response:
+            response.raise_for_status()
+            event_name: str | None = None
+            data_chunks: list[str] = []
+            async for line_bytes in response.content:
+                line = line_bytes.decode().strip()
+                if line == "":
+                    if event_name and data_chunks:
+                        # Join all ``data:`` lines (the spec allows multi‑line data)
+                        raw_data = "\n".join(data_chunks)
+                        try:
+                            return json.loads(raw_data)
+                        except json.JSONDecodeError as exc:
+                            raise ValueError(
+                                f"Failed to decode SSE data as JSON: {raw_data!r}"
+                            ) from exc
+                    event_name, data_chunks = None, []
+
+                if line.startswith("event:"):
+                    event_name = line.partition(":")[2].strip()
+                elif line.startswith("data:"):
+                    data_chunks.append(line.partition(":")[2].strip())
+
+    return await call_with_retry(url, _read_event)
+
+
+def decode_embedding(embedding: list[float] | str) -> list[float]:
+    """Embedding from a float or base64 encoded response (services that predate
+    encoding_format always answer with floats)"""
+    if isinstance(embedding, list):
+        return embedding
+    dtype = "<f2" if EMBEDDING_TRANSPORT_DTYPE == "float16" else "<f4"
+    return (
+        np.frombuffer(base64.b64decode(embedding), dtype=dtype)
+        .astype(np.float32)
+        .tolist()
+    )
 
 
 class CustomEmbedding(Embeddings):
-    def __init__(self, model="Qwen/Qwen3-Embedding-0.6B"):
+    def __init__(
+        self, model="Qwen/Qwen3-Embedding-0.6B", backend=None, dimensions=None
+    ):
+        self.backend = backend or EMBEDDING_BACKEND
+        if self.backend not in ("remote", "local"):
+            raise ValueError(f"Unknown embedding backend: {self.backend}")
+        if self.backend == "local" and LOCAL_EMBEDDING_MODEL:
+            model = LOCAL_EMBEDDING_MODEL
         self.model = model
+        self.dimensions = dimensions or EMBEDDING_DIMENSIONS
+        # cached embeddings differ per output size
+        self.cache_key = f"{model}@{self.dimensions}" if self.dimensions else model
         super().__init__()
 
     async def embed_documents(self, texts: list[str]) -> list[list[float]]:
         try:
-            resp = await self.get_embedding(texts)
+            return await self._embed(texts)
         except:
             return []
-        data = resp["data"]  # list of dicts
-        return [d["embedding"] for d in data]
 
     async def embed_query(self, text: str) -> list[float]:
+        cache = get_embedding_cache()
+        embedding = await cache.get(self.cache_key, text)
+        if embedding is not None:
+            return embedding
         try:
-            resp = await self.get_embedding(text)
+            [embedding] = await self._embed([text])
         except:
             return []
-        data = resp["data"][0]  # dict
-        return data["embedding"]
+        await cache.set(self.cache_key, text, embedding)
+        return embedding
+
+    async def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Embeds several queries with one request for the texts that aren't
+        cached yet. Failed embeddings are returned as empty lists."""
+        cache = get_embedding_cache()
+        embeddings = [await cache.get(self.cache_key, text) for text in texts]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if not missing:
+            return embeddings
+
+        try:
+            data = await self._embed([texts[i] for i in missing])
+        except:
+            data = [[] for _ in missing]
+        for i, embedding in zip(missing, data):
+            embeddings[i] = embedding
+            if embedding:
+                await cache.set(self.cache_key, texts[i], embedding)
+        return embeddings
+
+    async def _embed(self, texts: list[str]) -> list[list[float]]:
+        """Embeds the texts together with those of concurrent callers (see
+        embedding_batcher), raises on failure"""
+        if EMBEDDING_BATCH_WINDOW_MS <= 0:
+            resp = await self.get_embedding(texts)
+            data = sorted(resp["data"], key=lambda d: d["index"])
+            if len(data) != len(texts):
+                raise RuntimeError("Embedding service returned no embedding")
+            return [d["embedding"] for d in data]
+        batcher = get_embedding_batcher(
+            f"{self.backend}:{self.cache_key}", self.get_embedding
+        )
+        return await batcher.embed(texts)
 
     async def get_embedding(self, input: str | list):
-        url = "https://msvelan-code-embedding-model.hf.space/v1/embeddings"
+        if self.backend == "local":
+            return await create_local_embeddings(self.model, input, self.dimensions)
+
+        url = EMBEDDING_URL
         # Model accepts any sentence-transformer input
         headers = {
             "Content-Type": "application/json",
@@ -108,10 +167,15 @@ class CustomEmbedding(Embeddings):
         payload = {
             "model": self.model,
             "input": input,
+            "encoding_format": EMBEDDING_ENCODING_FORMAT,
+            "embedding_dtype": EMBEDDING_TRANSPORT_DTYPE,
         }
+        if self.dimensions:
+            payload["dimensions"] = self.dimensions
 
-        out = await _make_async_post_request(url, headers, payload)
-        # out = await self._make_async_post_request(url, headers, payload)
+        out = await request_json("POST", url, headers=headers, payload=payload)
+        for d in out["data"]:
+            d["embedding"] = decode_embedding(d["embedding"])
         return out
 
 
@@ -128,32 +192,22 @@ class ManimExecutor:
         """Executes code and returns error on execution if found"""
         url = self.base_url + "trigger-test-code"
         payload = {"uuid": self.uuid, "code": code}
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                await _make_async_post_request(url, self.headers, payload)
-                break
-            except:
-                if attempt == max_retries - 1:
-                    raise
-
-            # initialize out by sending SSE get request
-            # url = self.base_url + f"events/test-code/{self.uuid}"
-            # out = await _make_async_get_sse(
-            #     url, self.headers | {"Accept": "text/event-stream"}
-            # )
-            # long polling is enough for this usecase
-        for attempt in range(max_retries):
-            try:
-                out = await _make_async_get_request(
-                    url=f"{self.base_url}result/test-code/{self.uuid}",
-                    params={"poll_interval": 5, "timeout": 60 * 30},
-                    headers=self.headers,
-                )
-                break
-            except:
-                if attempt == max_retries - 1:
-                    raise
+        await request_json("POST", url, headers=self.headers, payload=payload)
+
+        # initialize out by sending SSE get request
+        # url = self.base_url + f"events/test-code/{self.uuid}"
+        # out = await _make_async_get_sse(
+        #     url, self.headers | {"Accept": "text/event-stream"}
+        # )
+        # long polling is enough for this usecase
+        out = await request_json(
+            "GET",
+            f"{self.base_url}result/test-code/{self.uuid}",
+            params={"poll_interval": 5, "timeout": 60 * 30},
+            headers=self.headers,
+            # long polling, the server answers within its timeout
+            read_timeout=60 * 31,
+        )
         return (out.get("error_message", ""), out.get("error", None))
 
     async def run_and_upload(self, code):
@@ -162,20 +216,14 @@ class ManimExecutor:
         """
         url = self.base_url + "run-and-upload"
         payload = {"uuid": self.uuid, "code": code}
-        try:
-            out = await _make_async_post_request(url, self.headers, payload)
-        except:
-            raise
+        out = await request_json("POST", url, headers=self.headers, payload=payload)
         return out.get("url", None)
 
     async def cleanup(self):
         """Executes code and returns error on execution if found"""
         url = self.base_url + "cleanup"
         payload = {"uuid": self.uuid}
-        try:
-            await _make_async_post_request(url, self.headers, payload)
-        except:
-            raise
+        await request_json("POST", url, headers=self.headers, payload=payload)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,174 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from backend.workflow.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 64 * 2**20))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", 60 * 60 * 24))
+# Optional second tier shared by all backend workers, disabled when empty
+EMBEDDING_CACHE_REDIS_URL = os.getenv("EMBEDDING_CACHE_REDIS_URL", "")
+EMBEDDING_CACHE_REDIS_TTL = int(
+    os.getenv("EMBEDDING_CACHE_REDIS_TTL", 60 * 60 * 24 * 7)
+)
+
+# Cached retrieval results, invalidated by the corpus version in the key
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2048"))
+
+
+class TTLLRUCache:
+    """Thread-safe in-process LRU cache with per-entry TTL.
+    Evicts least recently used entries once either `max_entries` or
+    `max_bytes` (sum of the sizes passed to `set`) is exceeded.
+    Hits, misses and evictions are counted as `<name>.hit|miss|evict`.
+    """
+
+    def __init__(self, name, max_entries, ttl=None, max_bytes=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            has_ttl = entry is not None and entry[0] is not None
+            if has_ttl and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                metrics.incr(f"{self.name}.miss")
+                return None
+            self._data.move_to_end(key)
+        metrics.incr(f"{self.name}.hit")
+        return entry[2]
+
+    def set(self, key, value, size=1):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (expires_at, size, value)
+            self.nbytes += size
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._data)))
+                metrics.incr(f"{self.name}.evict")
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self.nbytes -= size
+
+
+class EmbeddingCache:
+    """Two-tier cache for query embeddings keyed by (model, exact input text).
+    Tier 1 is an in-process TTLLRUCache, tier 2 an optional Redis shared by all
+    backend workers. Redis failures are logged and treated as misses.
+    """
+
+    def __init__(self):
+        self.local = TTLLRUCache(
+            "embedding_cache.local",
+            max_entries=EMBEDDING_CACHE_SIZE,
+            ttl=EMBEDDING_CACHE_TTL,
+            max_bytes=EMBEDDING_CACHE_MAX_BYTES,
+        )
+        self.redis = None
+        if EMBEDDING_CACHE_REDIS_URL:
+            import redis.asyncio as redis
+
+            self.redis = redis.from_url(EMBEDDING_CACHE_REDIS_URL)
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        digest = hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+        return f"emb:{digest}"
+
+    async def get(self, model: str, text: str) -> list[float] | None:
+        key = self.key(model, text)
+        vector = self.local.get(key)
+        if vector is not None or self.redis is None:
+            return vector
+
+        try:
+            raw = await self.redis.get(key)
+        except Exception as e:
+            logger.warning(f"Embedding cache redis GET failed: {e}")
+            return None
+        if raw is None:
+            metrics.incr("embedding_cache.redis.miss")
+            return None
+        metrics.incr("embedding_cache.redis.hit")
+        vector = array("f", raw).tolist()
+        self.local.set(key, vector, size=len(raw))
+        return vector
+
+    async def set(self, model: str, text: str, vector: list[float]):
+        key = self.key(model, text)
+        raw = array("f", vector).tobytes()
+        self.local.set(key, vector, size=len(raw))
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(key, raw, ex=EMBEDDING_CACHE_REDIS_TTL)
+        except Exception as e:
+            logger.warning(f"Embedding cache redis SET failed: {e}")
+
+
+_embedding_cache = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Returns the process-wide EmbeddingCache"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
+class RetrievalCache(TTLLRUCache):
+    """In-process cache of formatted retrieval rows keyed by
+    (embedding hash, type, k, corpus version). Entries of older corpus versions
+    are never hit again and age out through LRU eviction."""
+
+    def __init__(self):
+        super().__init__("retrieval_cache", max_entries=RETRIEVAL_CACHE_SIZE)
+
+    @staticmethod
+    def embedding_hash(embedding: list[float]) -> str:
+        return hashlib.sha256(array("f", embedding).tobytes()).hexdigest()
+
+
+_retrieval_cache = None
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    """Returns the process-wide RetrievalCache"""
+    global _retrieval_cache
+    if _retrieval_cache is None:
+        _retrieval_cache = RetrievalCache()
+    return _retrieval_cache
@@ -0,0 +1,138 @@
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+from backend.workflow.utils import metrics
+
+load_dotenv()
+
+# Max tokens of retrieved context handed to an agent per tool call / step
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Jaccard similarity (or containment) of word shingles above which a chunk is
+# dropped as a near duplicate of an already packed one
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+# Truncated chunks shorter than this are dropped instead
+MIN_BLOCK_TOKENS = 100
+SHINGLE_SIZE = 5
+
+# Only metadata the agents make use of, source paths etc. are left out
+METADATA_FIELDS = (
+    "filename",
+    "type",
+    "title",
+    "supplement",
+    "ref_classes",
+    "ref_functions",
+)
+
+_WORD = re.compile(r"\w+")
+
+
+@dataclass
+class PackedContext:
+    text: str
+    tokens: int
+    tokens_saved: int
+    duplicates_dropped: int
+    over_budget_dropped: int
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token), no tokenizer needed"""
+    return (len(text) + 3) // 4
+
+
+def _shingles(text: str) -> set:
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def _is_near_duplicate(shingles: set, kept: list[set]) -> bool:
+    for other in kept:
+        common = len(shingles & other)
+        if not common:
+            continue
+        jaccard = common / len(shingles | other)
+        containment = common / min(len(shingles), len(other))
+        if max(jaccard, containment) >= NEAR_DUPLICATE_THRESHOLD:
+            return True
+    return False
+
+
+def _unpacked_tokens(doc, score) -> int:
+    """Size of the block as format_retrieved_docs used to render it"""
+    metadata = "".join(f"{k}: {v}\n" for k, v in doc.metadata.items())
+    return estimate_tokens(
+        f"{'=' * 30}Block 00\nRelevance Score: {score}\n\n"
+        f"{doc.page_content}\n\nMetadata:\n{metadata}"
+    )
+
+
+def pack_retrieved_docs(
+    docs, token_budget=CONTEXT_TOKEN_BUDGET, metadata_fields=METADATA_FIELDS
+) -> PackedContext:
+    """Renders List[Tuple[Document, float]] as prompt context.
+    Chunks are taken most relevant first, exact and near duplicates are
+    dropped, and the output stops at `token_budget` (the last chunk that
+    doesn't fit is truncated). Only `metadata_fields` are emitted.
+    """
+    blocks = []
+    seen_hashes = set()
+    kept_shingles = []
+    tokens = 0
+    unpacked_tokens = 0
+    duplicates_dropped = 0
+    over_budget_dropped = 0
+
+    ranked = sorted(docs, key=lambda pair: pair[1], reverse=True)
+    for doc, score in ranked:
+        unpacked_tokens += _unpacked_tokens(doc, score)
+
+        content = doc.page_content.strip()
+        digest = hashlib.sha1(" ".join(content.lower().split()).encode()).digest()
+        shingles = _shingles(content)
+        if digest in seen_hashes or _is_near_duplicate(shingles, kept_shingles):
+            duplicates_dropped += 1
+            continue
+
+        metadata = ", ".join(
+            f"{k}={doc.metadata[k]}" for k in metadata_fields if doc.metadata.get(k)
+        )
+        header = (
+            f"{'=' * 15}Block {len(blocks) + 1}{'=' * 15}\n"
+            f"Relevance Score: {score:.3f}\n"
+        )
+        footer = f"\nMetadata: {metadata}\n" if metadata else "\n"
+
+        remaining = token_budget - tokens
+        overhead = estimate_tokens(header + footer)
+        content_tokens = estimate_tokens(content)
+        if overhead + content_tokens > remaining:
+            if remaining - overhead < MIN_BLOCK_TOKENS:
+                over_budget_dropped += 1
+                continue
+            content = content[: (remaining - overhead - 1) * 4] + "\n..."
+            content_tokens = estimate_tokens(content)
+
+        seen_hashes.add(digest)
+        kept_shingles.append(shingles)
+        blocks.append(header + content + footer)
+        tokens += overhead + content_tokens
+
+    tokens_saved = max(0, unpacked_tokens - tokens)
+    metrics.incr("context_packer.tokens_saved", tokens_saved)
+    return PackedContext(
+        text="\n".join(blocks),
+        tokens=tokens,
+        tokens_saved=tokens_saved,
+        duplicates_dropped=duplicates_dropped,
+        over_budget_dropped=over_budget_dropped,
+    )
@@ -0,0 +1,91 @@
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from backend.workflow.utils.pg_engine import pg_connection
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+EMBEDDINGS_TABLE = os.getenv("EMBEDDINGS_TABLE", "manim_docs")
+# How long a worker trusts its copy of the corpus version before re-reading it
+CORPUS_VERSION_TTL = float(os.getenv("CORPUS_VERSION_TTL", "60"))
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS public.corpus_versions(
+    corpus VARCHAR(100) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+_cached_version = None
+_cached_at = 0.0
+
+
+async def get_corpus_version() -> int:
+    """Returns the version of the embeddings corpus, re-read from postgres at
+    most every CORPUS_VERSION_TTL seconds. 0 if it was never bumped.
+    If postgres can't be read, the last known version is returned (and re-read
+    on the next call), without one the error is raised."""
+    global _cached_version, _cached_at
+    now = time.monotonic()
+    if _cached_version is not None and now - _cached_at < CORPUS_VERSION_TTL:
+        return _cached_version
+
+    try:
+        async with pg_connection() as conn:
+            # the table doesn't exist until the first bump
+            result = await conn.execute(
+                text("select to_regclass('public.corpus_versions') is not null")
+            )
+            version = None
+            if result.scalar():
+                result = await conn.execute(
+                    text(
+                        "select version from public.corpus_versions "
+                        "where corpus=:corpus"
+                    ),
+                    {"corpus": EMBEDDINGS_TABLE},
+                )
+                version = result.scalar()
+    except Exception as e:
+        if _cached_version is None:
+            raise
+        logger.warning(
+            f"Couldn't read corpus version, using version {_cached_version}: {e}"
+        )
+        return _cached_version
+
+    _cached_version = version or 0
+    _cached_at = now
+    return _cached_version
+
+
+async def bump_corpus_version() -> int:
+    """Increments the corpus version, invalidating retrieval caches of every
+    worker. Called by ingestion after a successful run."""
+    global _cached_version
+    async with pg_connection() as conn:
+        await conn.execute(text(_CREATE_TABLE))
+        result = await conn.execute(
+            text(
+                """
+                INSERT INTO public.corpus_versions (corpus, version)
+                VALUES (:corpus, 1)
+                ON CONFLICT (corpus) DO UPDATE
+                SET version = corpus_versions.version + 1, updated_at = now()
+                RETURNING version;
+                """
+            ),
+            {"corpus": EMBEDDINGS_TABLE},
+        )
+        version = result.scalar()
+        await conn.commit()
+    _cached_version = None
+    logger.info(f"Bumped corpus version of {EMBEDDINGS_TABLE} to {version}")
+    return version
@@ -0,0 +1,125 @@
+"""Client-side coalescing of embedding requests.
+
+Texts submitted by concurrent callers within EMBEDDING_BATCH_WINDOW_MS are sent
+to the embedding service as one request of at most EMBEDDING_MAX_BATCH_SIZE
+inputs, and each caller gets back the embeddings of its own texts.
+
+The request is sent from a clean context: the deadline and retry state of the
+caller that happened to open the batch (see resilience) don't apply to the
+texts of the others. Each caller only stops waiting at its own deadline.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+
+from backend.workflow.utils import metrics
+from backend.workflow.utils.resilience import DeadlineExceeded, time_remaining
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# How long the first queued text waits for others, 0 disables coalescing
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "10"))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "64"))
+
+# Sends a list of texts, returns the OpenAI style {"data": [{index, embedding}]}
+SendBatch = Callable[[list[str]], Awaitable[dict]]
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        send: SendBatch,
+        window_ms: float = EMBEDDING_BATCH_WINDOW_MS,
+        max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+    ):
+        self.send = send
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.loop = asyncio.get_running_loop()
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._flush_handle = None
+        self._in_flight = set()
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        """Queues the texts and waits for their embeddings. Raises if the
+        request carrying any of them fails."""
+        futures = []
+        for text in texts:
+            future = self.loop.create_future()
+            self._pending.append((text, future))
+            futures.append(future)
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+        if self._pending and self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(
+                self.window, self._flush, context=contextvars.Context()
+            )
+        timeout = asyncio.timeout(time_remaining())
+        try:
+            async with timeout:
+                return list(await asyncio.gather(*futures))
+        except TimeoutError as e:
+            if not timeout.expired():
+                raise
+            metrics.incr("http.deadline_exceeded")
+            raise DeadlineExceeded("Deadline exceeded waiting for embeddings") from e
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = self.loop.create_task(
+            self._send_batch(batch), context=contextvars.Context()
+        )
+        # keep a reference until done, the loop only holds weak ones
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send_batch(self, batch: list[tuple[str, asyncio.Future]]):
+        # identical texts from different callers are embedded once
+        unique = list(dict.fromkeys(text for text, _ in batch))
+        metrics.incr("embedding_batcher.requests")
+        metrics.incr("embedding_batcher.texts", len(batch))
+        metrics.incr("embedding_batcher.deduplicated", len(batch) - len(unique))
+        try:
+            resp = await self.send(unique)
+            by_index = {d["index"]: d["embedding"] for d in resp["data"]}
+            embeddings = {text: by_index.get(i) for i, text in enumerate(unique)}
+        except Exception as e:
+            logger.warning(f"Embedding batch of {len(unique)} texts failed: {e!r}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for text, future in batch:
+            if future.done():  # caller was cancelled
+                continue
+            if embeddings[text] is None:
+                future.set_exception(
+                    RuntimeError("Embedding service returned no embedding")
+                )
+            else:
+                future.set_result(embeddings[text])
+
+
+_batchers: dict[str, EmbeddingBatcher] = {}
+
+
+def get_embedding_batcher(key: str, send: SendBatch) -> EmbeddingBatcher:
+    """Returns the batcher of `key` (backend and model) for the running event
+    loop, every CustomEmbedding instance of the loop shares it"""
+    batcher = _batchers.get(key)
+    if batcher is None or batcher.loop is not asyncio.get_running_loop():
+        batcher = _batchers[key] = EmbeddingBatcher(send)
+    return batcher
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import os
+
+import aiohttp
+from dotenv import load_dotenv
+
+from backend.workflow.utils import metrics
+from backend.workflow.utils.resilience import RETRY_MAX_ATTEMPTS, call_with_retry
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "10"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+# Max wait between two reads of a response, long polls pass their own
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+
+# One session per event loop, scripts also make calls on PGEngine's background
+# loop (PGVectorStore embeds there)
+_sessions: dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+
+async def _on_connection_create_end(session, ctx, params):
+    metrics.incr("http.connections.created")
+
+
+async def _on_connection_reuseconn(session, ctx, params):
+    metrics.incr("http.connections.reused")
+
+
+def _create_session() -> aiohttp.ClientSession:
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=request_timeout(),
+        trace_configs=[trace_config],
+    )
+
+
+def request_timeout(read_timeout: float | None = None) -> aiohttp.ClientTimeout:
+    """Connect timeout plus a read timeout (HTTP_READ_TIMEOUT by default), no
+    limit on the total time of a request"""
+    return aiohttp.ClientTimeout(
+        total=None,
+        connect=HTTP_CONNECT_TIMEOUT,
+        sock_read=read_timeout or HTTP_READ_TIMEOUT,
+    )
+
+
+async def start_http_session():
+    """Creates the shared session, called on app startup"""
+    get_http_session()
+    logger.info(f"Started HTTP session with limit_per_host={HTTP_POOL_LIMIT_PER_HOST}")
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Returns the keep-alive session of the running event loop, created lazily
+    outside the app (scripts)"""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        # loops closed without close_http_session took their connections along
+        for closed in [other for other in _sessions if other.is_closed()]:
+            del _sessions[closed]
+        session = _sessions[loop] = _create_session()
+    return session
+
+
+async def close_http_session():
+    """Closes the session of every event loop and its pooled connections on
+    shutdown, each on the loop it was created on"""
+    current = asyncio.get_running_loop()
+    for loop, session in list(_sessions.items()):
+        del _sessions[loop]
+        if session.closed:
+            continue
+        if loop is current:
+            await session.close()
+        elif loop.is_running():
+            await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(session.close(), loop)
+            )
+        else:
+            continue
+        logger.info("Closed HTTP session")
+
+
+async def request_json(
+    method: str,
+    url: str,
+    *,
+    headers: dict | None = None,
+    payload: dict | None = None,
+    params: dict | None = None,
+    read_timeout: float | None = None,
+    max_attempts: int = RETRY_MAX_ATTEMPTS,
+):
+    """JSON request on the shared session with the shared retry policy
+    (see resilience), raises after the last failed attempt"""
+    session = get_http_session()
+
+    async def _call():
+        async with session.request(
+            method,
+            url,
+            json=payload,
+            headers=headers,
+            params=params,
+            timeout=request_timeout(read_timeout),
+        ) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    return await call_with_retry(url, _call, max_attempts)
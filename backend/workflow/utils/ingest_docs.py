@@ -14,9 +14,15 @@ from langchain_text_splitters import (
     Language,
     RecursiveCharacterTextSplitter,
 )
+from sqlalchemy import text
 from tenacity import retry, stop_after_attempt, wait_fixed
 
+from backend.workflow.utils.corpus_version import bump_corpus_version
 from backend.workflow.utils.HFSpace.hf_space_wrapper import CustomEmbedding
+from backend.workflow.utils.http_client import close_http_session
+from backend.workflow.utils.pg_engine import _get_connection_string, close_pg_engine
+from backend.workflow.utils.pg_indexes import VECTOR_SIZE
+from backend.workflow.utils.symbol_index import write_symbol_index
 
 logger = logging.getLogger(__name__)
 
@@ -46,39 +52,78 @@ base_files = [
 base_dir_walk = ["docs/source/reference_index/"]
 
 
+_vector_store = None
+
+
 async def _get_vector_store():
-    POSTGRES_USER = os.getenv("POSTGRES_USER")
-    POSTGRES_HOST = os.getenv("POSTGRES_HOST")
-    POSTGRES_DB = os.getenv("POSTGRES_DB")
-    POSTGRES_PORT = os.getenv("POSTGRES_PORT")
+    global _vector_store
+    if _vector_store is not None:
+        return _vector_store
+
     EMBEDDINGS_TABLE = os.getenv("EMBEDDINGS_TABLE")
 
-    CONNECTION_STRING = (
-        f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_HOST}"
-        f":{POSTGRES_PORT}/{POSTGRES_DB}"
+    # NOTE: the store runs on PGEngine's background loop, so it keeps its own
+    # engine instead of the shared one used for retrieval.
+    pg_engine = PGEngine.from_connection_string(
+        url=_get_connection_string(), pool_pre_ping=True
     )
-    pg_engine = PGEngine.from_connection_string(url=CONNECTION_STRING)
 
-    # NOTE: table is already created, just connecting to it.
+    await _ensure_embeddings_table(pg_engine, EMBEDDINGS_TABLE)
+
     # NOTE: can provide k value here
-    store = await PGVectorStore.create(
+    _vector_store = await PGVectorStore.create(
         engine=pg_engine,
         table_name=EMBEDDINGS_TABLE,
         # schema_name=SCHEMA_NAME,
         embedding_service=embed_service,
     )
-    return store
+    return _vector_store
 
 
-async def ingest_docs():
-    abs_files = [os.path.join(MANIM_DIR, file) for file in base_files]
+async def _ensure_embeddings_table(pg_engine: PGEngine, table_name: str):
+    """Creates the embeddings table for VECTOR_SIZE-d vectors if it doesn't
+    exist, fails if the existing one stores vectors of another size"""
+
+    async def _stored_vector_size():
+        async with pg_engine._pool.connect() as conn:
+            result = await conn.execute(
+                text(
+                    "select atttypmod from pg_attribute "
+                    "where attrelid = to_regclass(:table) and attname = 'embedding'"
+                ),
+                {"table": f"public.{table_name}"},
+            )
+            return result.scalar()
+
+    vector_size = await pg_engine._run_as_async(_stored_vector_size())
+    if vector_size is None:
+        await pg_engine.ainit_vectorstore_table(
+            table_name=table_name, vector_size=VECTOR_SIZE
+        )
+        logger.info(f"Created table {table_name} for {VECTOR_SIZE}-d vectors")
+    elif vector_size != VECTOR_SIZE:
+        raise ValueError(
+            f"Table {table_name} stores {vector_size}-d vectors but VECTOR_SIZE "
+            f"is {VECTOR_SIZE}, drop it or set another EMBEDDINGS_TABLE"
+        )
+
+
+def _get_ingest_files(manim_dir=MANIM_DIR):
+    """Absolute paths of all files of the manim repo that are ingested"""
+    abs_files = [os.path.join(manim_dir, file) for file in base_files]
     for base_directory_path in base_dir_walk:
-        directory_path = os.path.join(MANIM_DIR, base_directory_path)
+        directory_path = os.path.join(manim_dir, base_directory_path)
         for root, _, filenames in os.walk(directory_path):
             for filename in filenames:
                 abs_files.append(os.path.join(root, filename))
+    return abs_files
+
+
+async def ingest_docs():
+    abs_files = _get_ingest_files()
 
     doc_ids = []
+    all_documents = []
 
     with concurrent.futures.ProcessPoolExecutor(11) as executor:
         future_to_file = {
@@ -88,6 +133,7 @@ async def ingest_docs():
             file = future_to_file[future]
             try:
                 file_documents = future.result()
+                all_documents.extend(file_documents)
 
                 # NOTE: below can be handled separately using asyncio.gather,
                 # but server can't handle many parallel requests
@@ -107,6 +153,11 @@ async def ingest_docs():
 added %d objects to store"
                     % (file, len(file_documents), n)
                 )
+
+    await write_symbol_index(all_documents)
+    if doc_ids:
+        # invalidate cached retrieval results of every backend worker
+        await bump_corpus_version()
     return doc_ids
 
 
@@ -394,6 +445,14 @@ def _get_summary_documents(blocks: List[Tuple[str, str]], source: str):
     return docs
 
 
+async def _main():
+    try:
+        return await ingest_docs()
+    finally:
+        await close_http_session()
+        await close_pg_engine()
+
+
 if __name__ == "__main__":
-    doc_ids = asyncio.run(ingest_docs())
+    doc_ids = asyncio.run(_main())
     logger.info("Ingested %d documents" % len(doc_ids))
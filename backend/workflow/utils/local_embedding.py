@@ -0,0 +1,90 @@
+"""In-process embedding backend (EMBEDDING_BACKEND=local).
+
+Loads the SentenceTransformer model once per process and runs every encode on
+a single dedicated thread, so the event loop never blocks and concurrent
+encodes don't compete for the cores. Needs the optional sentence-transformers
+dependency (`pip install sentence-transformers`).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+from backend.workflow.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Model served locally, defaults to the one CustomEmbedding asks for. A smaller
+# model only works with an index ingested with that same model.
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "")
+LOCAL_EMBEDDING_DEVICE = os.getenv("LOCAL_EMBEDDING_DEVICE", "cpu")
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+
+_models = {}
+# loads and encodes only ever run on this thread
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-embedding")
+
+
+def _get_model(model_name: str):
+    if model_name not in _models:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError(
+                "EMBEDDING_BACKEND=local needs sentence-transformers installed"
+            ) from e
+        logger.info(f"Loading local embedding model {model_name}...")
+        _models[model_name] = SentenceTransformer(
+            model_name, device=LOCAL_EMBEDDING_DEVICE
+        )
+        logger.info(f"Loaded local embedding model {model_name}")
+    return _models[model_name]
+
+
+def _encode(
+    model_name: str, texts: list[str], dimensions: int | None = None
+) -> list[list[float]]:
+    model = _get_model(model_name)
+    embeddings = model.encode(
+        texts, batch_size=LOCAL_EMBEDDING_BATCH_SIZE, convert_to_numpy=True
+    )
+    if dimensions:
+        # Matryoshka truncation, renormalized like the embedding service does
+        embeddings = embeddings[:, :dimensions]
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+    return embeddings.tolist()
+
+
+async def load_local_model(model_name: str):
+    """Loads the model ahead of the first query, e.g. on app startup"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_executor, _get_model, model_name)
+
+
+async def create_local_embeddings(
+    model_name: str, input: str | list, dimensions: int | None = None
+) -> dict:
+    """Same response format as the embedding service's /v1/embeddings"""
+    texts = [input] if isinstance(input, str) else input
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    embeddings = await loop.run_in_executor(
+        _executor, _encode, model_name, texts, dimensions
+    )
+    metrics.observe("local_embedding.encode", time.perf_counter() - start)
+    return {
+        "object": "list",
+        "model": model_name,
+        "data": [
+            {"object": "embedding", "embedding": embedding, "index": i}
+            for i, embedding in enumerate(embeddings)
+        ],
+    }
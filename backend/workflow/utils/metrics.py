@@ -0,0 +1,65 @@
+import threading
+from collections import defaultdict, deque
+
+# Number of most recent samples kept per latency metric for percentiles
+MAX_SAMPLES = 2048
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_latencies = {}
+
+
+class _LatencyRecorder:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def snapshot(self):
+        ordered = sorted(self.samples)
+
+        def percentile(p):
+            if not ordered:
+                return 0.0
+            idx = min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))
+            return ordered[idx] * 1000
+
+        return {
+            "count": self.count,
+            "mean_ms": (self.total / self.count) * 1000 if self.count else 0.0,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": self.max * 1000,
+        }
+
+
+def incr(name: str, value: int = 1):
+    """Increment counter `name` by `value`"""
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, seconds: float):
+    """Record a latency sample (in seconds) for `name`"""
+    with _lock:
+        recorder = _latencies.get(name)
+        if recorder is None:
+            recorder = _latencies[name] = _LatencyRecorder()
+        recorder.add(seconds)
+
+
+def snapshot() -> dict:
+    """Returns current counters and latency summaries (in milliseconds)"""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "latencies": {name: r.snapshot() for name, r in _latencies.items()},
+        }
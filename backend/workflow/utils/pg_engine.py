@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from langchain_postgres import PGEngine
+
+from backend.workflow.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Pool settings for the process-wide engine, see sqlalchemy create_async_engine
+PG_POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "5"))
+PG_MAX_OVERFLOW = int(os.getenv("PG_MAX_OVERFLOW", "5"))
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "30"))
+PG_POOL_RECYCLE = int(os.getenv("PG_POOL_RECYCLE", "1800"))
+
+_pg_engine: PGEngine | None = None
+_pg_engine_lock = asyncio.Lock()
+
+
+def _get_connection_string():
+    POSTGRES_USER = os.getenv("POSTGRES_USER")
+    POSTGRES_HOST = os.getenv("POSTGRES_HOST")
+    POSTGRES_DB = os.getenv("POSTGRES_DB")
+    POSTGRES_PORT = os.getenv("POSTGRES_PORT")
+
+    return (
+        f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_HOST}"
+        f":{POSTGRES_PORT}/{POSTGRES_DB}"
+    )
+
+
+async def init_pg_engine() -> PGEngine:
+    """Creates the process-wide PGEngine, called once on app startup"""
+    global _pg_engine
+    async with _pg_engine_lock:
+        if _pg_engine is None:
+            _pg_engine = PGEngine.from_connection_string(
+                url=_get_connection_string(),
+                pool_size=PG_POOL_SIZE,
+                max_overflow=PG_MAX_OVERFLOW,
+                pool_timeout=PG_POOL_TIMEOUT,
+                pool_recycle=PG_POOL_RECYCLE,
+                pool_pre_ping=True,
+            )
+            logger.info(
+                f"Created PGEngine with pool_size={PG_POOL_SIZE}, "
+                f"max_overflow={PG_MAX_OVERFLOW}"
+            )
+    return _pg_engine
+
+
+async def get_pg_engine() -> PGEngine:
+    """Returns the shared PGEngine, creating it lazily outside the app
+    (scripts, notebooks)"""
+    if _pg_engine is None:
+        return await init_pg_engine()
+    return _pg_engine
+
+
+async def close_pg_engine():
+    """Disposes the connection pool of the shared PGEngine on shutdown"""
+    global _pg_engine
+    async with _pg_engine_lock:
+        if _pg_engine is not None:
+            await _pg_engine._pool.dispose()
+            _pg_engine = None
+            logger.info("Closed PGEngine connection pool")
+
+
+@asynccontextmanager
+async def pg_connection():
+    """Checks out a connection from the shared pool, recording checkout
+    latency under the `pg.checkout` metric"""
+    pg_engine = await get_pg_engine()
+    start = time.perf_counter()
+    async with pg_engine._pool.connect() as conn:
+        metrics.observe("pg.checkout", time.perf_counter() - start)
+        yield conn
@@ -0,0 +1,295 @@
+"""ANN index maintenance for the embeddings table.
+
+Adds a generated `doc_type` column (langchain_metadata->>'type') and one
+partial HNSW index per document type, so each per-type branch of the
+retrieval query is an index scan over only that type's rows.
+
+Optionally adds a compact copy of the embeddings (VECTOR_QUANTIZATION=halfvec
+or binary) as a generated column, so ingestion fills it automatically. The
+per-type HNSW indexes are then built on the compact column, which only
+selects candidates; they are rescored against the full precision vectors.
+
+Adding a STORED generated column rewrites the table under an ACCESS EXCLUSIVE
+lock, so `create` (the first time) and `quantize` block retrieval and ingestion
+until the rewrite is done; run them in a maintenance window. Only the index
+builds that follow are CONCURRENTLY.
+
+    python -m backend.workflow.utils.pg_indexes create    # column + indexes
+    python -m backend.workflow.utils.pg_indexes quantize halfvec|binary
+    python -m backend.workflow.utils.pg_indexes explain   # index usage report
+"""
+
+import asyncio
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from backend.workflow.utils.pg_engine import pg_connection
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DOC_TYPES = ("code", "documentation", "summary")
+
+# HNSW build parameters, see pgvector docs
+PG_HNSW_M = int(os.getenv("PG_HNSW_M", "16"))
+PG_HNSW_EF_CONSTRUCTION = int(os.getenv("PG_HNSW_EF_CONSTRUCTION", "64"))
+# Minimum candidate list size for searches, raised per query to cover k
+PG_HNSW_EF_SEARCH = int(os.getenv("PG_HNSW_EF_SEARCH", "40"))
+
+# Size of the stored vectors, EMBEDDING_DIMENSIONS when the client truncates
+_EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS") or 0)
+VECTOR_SIZE = int(os.getenv("VECTOR_SIZE") or _EMBEDDING_DIMENSIONS or 1024)
+if _EMBEDDING_DIMENSIONS and VECTOR_SIZE != _EMBEDDING_DIMENSIONS:
+    raise ValueError(
+        f"VECTOR_SIZE={VECTOR_SIZE} doesn't match EMBEDDING_DIMENSIONS="
+        f"{_EMBEDDING_DIMENSIONS}, unset VECTOR_SIZE to follow it"
+    )
+# "none" (default), "halfvec" or "binary"; run the quantize command first
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+# Candidates fetched from the compact index per requested row before rescoring,
+# unset uses the default of the quantization: bit vectors rank far less exactly
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR") or 0)
+DEFAULT_RESCORE_FACTORS = {"halfvec": 4, "binary": 20}
+
+TYPE_EXPRESSION = "langchain_metadata->>'type'"
+
+_type_column = None
+
+
+def index_name(type: str, quantization: str = "none") -> str:
+    if quantization == "none":
+        return f"manim_docs_{type}_hnsw"
+    return f"manim_docs_{type}_{quantization}_hnsw"
+
+
+def _quantized_column(quantization: str):
+    """(column, column definition, HNSW opclass, candidate distance expression)"""
+    if quantization == "halfvec":
+        return (
+            "embedding_half",
+            f"halfvec({VECTOR_SIZE}) GENERATED ALWAYS AS "
+            f"(embedding::halfvec({VECTOR_SIZE})) STORED",
+            "halfvec_cosine_ops",
+            f"embedding_half <=> CAST(:query_embedding AS halfvec({VECTOR_SIZE}))",
+        )
+    if quantization == "binary":
+        return (
+            "embedding_bit",
+            f"bit({VECTOR_SIZE}) GENERATED ALWAYS AS "
+            f"(binary_quantize(embedding)::bit({VECTOR_SIZE})) STORED",
+            "bit_hamming_ops",
+            "embedding_bit <~> "
+            f"binary_quantize(CAST(:query_embedding AS vector))::bit({VECTOR_SIZE})",
+        )
+    raise ValueError(f"Unknown vector quantization: {quantization}")
+
+
+def candidates_for(k: int) -> int:
+    """Rows fetched from the compact index before rescoring to the top k"""
+    return k * (RESCORE_FACTOR or DEFAULT_RESCORE_FACTORS[VECTOR_QUANTIZATION])
+
+
+def search_branch_sql(i: int, type: str, type_column: str) -> str:
+    """Retrieval SQL for the top :k_{i} rows of `type`, one branch of the
+    UNION ALL in retrieve._query_pgvector. Binds :query_embedding and :k_{i}.
+    With VECTOR_QUANTIZATION the compact column selects :n_{i} candidates
+    (see candidates_for) which are then ordered by exact distance."""
+    where = f"{type_column}={type_literal(type)}"
+    if VECTOR_QUANTIZATION == "none":
+        return f"""
+    (select langchain_id, content, langchain_metadata,
+    (embedding <=> CAST(:query_embedding AS vector)) as distance,
+    {i} as type_order
+    from public.manim_docs
+    where {where}
+    order by distance
+    limit :k_{i})"""
+
+    *_, candidate_distance = _quantized_column(VECTOR_QUANTIZATION)
+    return f"""
+    (select langchain_id, content, langchain_metadata,
+    (embedding <=> CAST(:query_embedding AS vector)) as distance,
+    {i} as type_order
+    from (
+        select langchain_id, content, langchain_metadata, embedding
+        from public.manim_docs
+        where {where}
+        order by {candidate_distance}
+        limit :n_{i}
+    ) candidates
+    order by distance
+    limit :k_{i})"""
+
+
+def search_branch_params(i: int, k: int) -> dict:
+    params = {f"k_{i}": k}
+    if VECTOR_QUANTIZATION != "none":
+        params[f"n_{i}"] = candidates_for(k)
+    return params
+
+
+def ef_search_for(k: int) -> int:
+    """hnsw.ef_search for a query returning at most k rows"""
+    if VECTOR_QUANTIZATION != "none":
+        k = candidates_for(k)
+    return max(PG_HNSW_EF_SEARCH, 2 * k)
+
+
+def type_literal(type: str) -> str:
+    """Type as an SQL literal. Inlined instead of bound so the planner can match
+    the partial index predicate even with generic prepared-statement plans."""
+    if type not in DOC_TYPES:
+        raise ValueError(f"Unknown document type: {type}")
+    return f"'{type}'"
+
+
+async def get_type_column() -> str:
+    """Returns `doc_type` if the generated column exists, otherwise the JSON
+    expression it is generated from. Checked once per process."""
+    global _type_column
+    if _type_column is None:
+        async with pg_connection() as conn:
+            result = await conn.execute(
+                text(
+                    """
+                    select 1 from information_schema.columns
+                    where table_schema='public' and table_name='manim_docs'
+                    and column_name='doc_type'
+                    """
+                )
+            )
+            _type_column = "doc_type" if result.scalar() else TYPE_EXPRESSION
+    return _type_column
+
+
+async def create_type_indexes():
+    """Adds the generated doc_type column and builds the per-type partial HNSW
+    indexes. Adding the column rewrites the table under an ACCESS EXCLUSIVE
+    lock, blocking reads and writes; the indexes are then built CONCURRENTLY."""
+    global _type_column
+    async with pg_connection() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(
+            text(
+                f"""
+                ALTER TABLE public.manim_docs ADD COLUMN IF NOT EXISTS doc_type
+                TEXT GENERATED ALWAYS AS ({TYPE_EXPRESSION}) STORED;
+                """
+            )
+        )
+        logger.info("Added doc_type column")
+        for type in DOC_TYPES:
+            await conn.execute(
+                text(
+                    f"""
+                    CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name(type)}
+                    ON public.manim_docs
+                    USING hnsw (embedding vector_cosine_ops)
+                    WITH (m = {PG_HNSW_M}, ef_construction = {PG_HNSW_EF_CONSTRUCTION})
+                    WHERE doc_type = {type_literal(type)};
+                    """
+                )
+            )
+            logger.info(f"Created index {index_name(type)}")
+        await conn.execute(text("ANALYZE public.manim_docs;"))
+    _type_column = "doc_type"
+
+
+async def create_quantized_indexes(quantization: str = VECTOR_QUANTIZATION):
+    """Adds the compact embedding column as a generated column (filled for
+    existing rows and by every later insert) and builds per-type partial HNSW
+    indexes on it. Like create_type_indexes, adding the column rewrites the
+    table under an ACCESS EXCLUSIVE lock."""
+    column, definition, opclass, _ = _quantized_column(quantization)
+    await create_type_indexes()
+    async with pg_connection() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(
+            text(
+                f"ALTER TABLE public.manim_docs "
+                f"ADD COLUMN IF NOT EXISTS {column} {definition};"
+            )
+        )
+        logger.info(f"Added {column} column")
+        for type in DOC_TYPES:
+            await conn.execute(
+                text(
+                    f"""
+                    CREATE INDEX CONCURRENTLY IF NOT EXISTS
+                    {index_name(type, quantization)}
+                    ON public.manim_docs
+                    USING hnsw ({column} {opclass})
+                    WITH (m = {PG_HNSW_M}, ef_construction = {PG_HNSW_EF_CONSTRUCTION})
+                    WHERE doc_type = {type_literal(type)};
+                    """
+                )
+            )
+            logger.info(f"Created index {index_name(type, quantization)}")
+        await conn.execute(text("ANALYZE public.manim_docs;"))
+
+
+async def explain_search(type: str, k: int = 3) -> dict:
+    """EXPLAINs the retrieval branch of `type` with a stored embedding as the
+    query vector. Returns the plan and whether the type's HNSW index is used."""
+    type_column = await get_type_column()
+    async with pg_connection() as conn:
+        await conn.execute(text(f"SET LOCAL hnsw.ef_search = {ef_search_for(k)}"))
+        query_embedding = (
+            await conn.execute(
+                text(
+                    f"select embedding::text from public.manim_docs "
+                    f"where {type_column}={type_literal(type)} limit 1"
+                )
+            )
+        ).scalar()
+        if query_embedding is None:
+            return {"type": type, "index_used": False, "plan": "no rows"}
+        branch = search_branch_sql(0, type, type_column)
+        result = await conn.execute(
+            text(f"EXPLAIN (ANALYZE, BUFFERS) select * from {branch} branch"),
+            {"query_embedding": query_embedding} | search_branch_params(0, k),
+        )
+        plan = "\n".join(row[0] for row in result.fetchall())
+    index = index_name(type, VECTOR_QUANTIZATION)
+    return {"type": type, "index_used": index in plan, "plan": plan}
+
+
+COMMANDS = ("create", "quantize", "explain")
+QUANTIZATIONS = ("halfvec", "binary")
+USAGE = (
+    "usage: python -m backend.workflow.utils.pg_indexes "
+    "create | quantize halfvec|binary | explain"
+)
+
+
+async def _main(command: str, quantization: str | None = None):
+    from backend.workflow.utils.pg_engine import close_pg_engine
+
+    if command not in COMMANDS:
+        raise SystemExit(f"Unknown command {command!r}\n{USAGE}")
+    if command == "quantize" and quantization not in QUANTIZATIONS:
+        raise SystemExit(f"quantize needs one of {', '.join(QUANTIZATIONS)}\n{USAGE}")
+    try:
+        if command == "create":
+            await create_type_indexes()
+        elif command == "quantize":
+            await create_quantized_indexes(quantization)
+        for type in DOC_TYPES:
+            report = await explain_search(type)
+            logger.info(
+                f"{type}: index used = {report['index_used']}\n{report['plan']}"
+            )
+    finally:
+        await close_pg_engine()
+
+
+if __name__ == "__main__":
+    from backend.workflow.utils.logging_config import configure_logging
+
+    configure_logging()
+    asyncio.run(_main(*sys.argv[1:3] or ["explain"]))
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from backend.workflow.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+RETRIEVAL_PREFETCH = os.getenv("RETRIEVAL_PREFETCH", "false").lower() == "true"
+# Concurrent prefetch searches, keeps pool connections free for foreground calls
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "3"))
+# k per type fetched for every step, matches the default limit of the agent tools
+PREFETCH_K = int(os.getenv("PREFETCH_K", "3"))
+# How long a step waits for its prefetched documents before going without
+PREFETCH_WAIT = float(os.getenv("PREFETCH_WAIT", "30"))
+# Jobs whose prefetch is kept, the oldest are dropped (e.g. jobs that failed)
+MAX_PREFETCHED_JOBS = 64
+
+# Prefetch task of every job, also keeps it from being garbage collected
+_prefetched: "OrderedDict[str, asyncio.Task]" = OrderedDict()
+
+
+async def prefetch_steps(descriptions: list[str]) -> list[str]:
+    """Embeds all step descriptions in one batch and retrieves the documents of
+    every step, returns the packed context of each step"""
+    from backend.workflow.utils.retrieve import (
+        format_retrieved_docs,
+        retrieve_docs_batch,
+    )
+
+    ks = {"code": PREFETCH_K, "documentation": PREFETCH_K, "summary": PREFETCH_K}
+    docs = await retrieve_docs_batch(
+        [(d, ks) for d in descriptions], concurrency=PREFETCH_CONCURRENCY
+    )
+    return [format_retrieved_docs(step_docs) if step_docs else "" for step_docs in docs]
+
+
+def schedule_prefetch(job_id: str, descriptions: list[str]):
+    """Starts prefetch_steps for the steps of a job in the background, its
+    results are picked up per step with prefetched_docs"""
+    task = asyncio.create_task(prefetch_steps(descriptions))
+    _prefetched[job_id] = task
+    while len(_prefetched) > MAX_PREFETCHED_JOBS:
+        _prefetched.popitem(last=False)[1].cancel()
+    return task
+
+
+async def prefetched_docs(job_id: str, step: int) -> str:
+    """Packed documents of step `step` of the job, empty if there's no prefetch
+    or it failed or didn't finish within PREFETCH_WAIT (the agent tools can
+    still fetch documents)"""
+    task = _prefetched.get(job_id)
+    if task is None:
+        return ""
+    try:
+        async with asyncio.timeout(PREFETCH_WAIT):
+            steps = await asyncio.shield(task)
+    except Exception as e:
+        metrics.incr("prefetch.failed")
+        logger.warning(f"Retrieval prefetch for step {step + 1} unavailable: {e!r}")
+        return ""
+    if step >= len(steps) - 1:
+        _prefetched.pop(job_id, None)
+    metrics.incr("prefetch.steps")
+    return steps[step] if step < len(steps) else ""
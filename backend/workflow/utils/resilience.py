@@ -0,0 +1,250 @@
+"""Shared retry policy for outbound HTTP calls.
+
+- Retries use exponential backoff with full jitter, only for connection
+  errors, timeouts and 408/429/5xx responses.
+- A deadline set with `deadline(seconds)` (the job budget) propagates through
+  contextvars to every call made within it; attempts are cut off and no retry
+  is started once it has passed.
+- Calls made while another call_with_retry is already retrying (e.g. a helper
+  inside a retried operation) make a single attempt, so retries don't multiply.
+- Every endpoint (scheme + host) has a gRPC style retry budget that stops
+  retries when most calls fail, and a circuit breaker that fails fast after
+  CIRCUIT_FAILURE_THRESHOLD consecutive failures until CIRCUIT_RESET_TIMEOUT
+  has passed, then lets one probe call through.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable, TypeVar
+from urllib.parse import urlsplit
+
+import aiohttp
+from dotenv import load_dotenv
+
+from backend.workflow.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "10"))
+# Retry tokens per endpoint, a failure takes one and a success gives back
+# RETRY_BUDGET_RATIO; retries stop while less than half are left
+RETRY_BUDGET_TOKENS = float(os.getenv("RETRY_BUDGET_TOKENS", "10"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar(
+    "deadline", default=None
+)
+_retrying: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "retrying", default=False
+)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def deadline(seconds: float):
+    """Calls made within the block must finish in `seconds`. Nested deadlines
+    can only shorten the outer one."""
+    new_deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        new_deadline = min(new_deadline, current)
+    token = _deadline.set(new_deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_remaining() -> float | None:
+    """Seconds left until the current deadline, None without one"""
+    current = _deadline.get()
+    if current is None:
+        return None
+    return current - time.monotonic()
+
+
+class RetryBudget:
+    def __init__(self, max_tokens=RETRY_BUDGET_TOKENS, token_ratio=RETRY_BUDGET_RATIO):
+        self.max_tokens = max_tokens
+        self.token_ratio = token_ratio
+        self.tokens = max_tokens
+
+    def on_success(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.token_ratio)
+
+    def on_failure(self):
+        self.tokens = max(0.0, self.tokens - 1)
+
+    def allows_retry(self) -> bool:
+        return self.tokens > self.max_tokens / 2
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=CIRCUIT_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def before_call(self):
+        """Raises CircuitOpenError unless the call may go through"""
+        state = self.state
+        if state == "open" or (state == "half_open" and self.probing):
+            metrics.incr("http.circuit_rejected")
+            raise CircuitOpenError(f"Circuit for {self.name} is open")
+        if state == "half_open":
+            self.probing = True
+
+    def on_success(self):
+        if self.opened_at is not None:
+            logger.info(f"Circuit for {self.name} closed")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def on_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(
+                    f"Circuit for {self.name} opened after {self.failures} failures"
+                )
+                metrics.incr("http.circuit_opened")
+            self.opened_at = time.monotonic()
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_budgets: dict[str, RetryBudget] = {}
+
+
+def endpoint_of(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    if endpoint not in _breakers:
+        _breakers[endpoint] = CircuitBreaker(endpoint)
+    return _breakers[endpoint]
+
+
+def get_retry_budget(endpoint: str) -> RetryBudget:
+    if endpoint not in _budgets:
+        _budgets[endpoint] = RetryBudget()
+    return _budgets[endpoint]
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status in RETRYABLE_STATUSES
+    return isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full jitter backoff before retry number `attempt` (1-based)"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+
+
+async def call_with_retry(
+    url: str,
+    call: Callable[[], Awaitable[T]],
+    max_attempts: int = RETRY_MAX_ATTEMPTS,
+) -> T:
+    """Runs `call` (one request to `url`) with the shared retry policy"""
+    endpoint = endpoint_of(url)
+    breaker = get_circuit_breaker(endpoint)
+    budget = get_retry_budget(endpoint)
+    if _retrying.get():
+        max_attempts = 1
+    token = _retrying.set(True)
+    try:
+        attempt = 1
+        while True:
+            remaining = time_remaining()
+            if remaining is not None and remaining <= 0:
+                metrics.incr("http.deadline_exceeded")
+                raise DeadlineExceeded(f"Deadline exceeded before calling {url}")
+            breaker.before_call()
+            try:
+                async with asyncio.timeout(remaining):
+                    result = await call()
+            except Exception as e:
+                remaining = time_remaining()
+                if remaining is not None and remaining <= 0:
+                    # out of time, not the endpoint's fault
+                    breaker.probing = False
+                    metrics.incr("http.deadline_exceeded")
+                    raise DeadlineExceeded(f"Deadline exceeded calling {url}") from e
+                if not is_retryable(e):
+                    # e.g. a 4xx or a local error, says nothing about the
+                    # endpoint's health; a probe gets another chance
+                    breaker.probing = False
+                    raise
+                if not getattr(e, "_failure_recorded", False):
+                    # recorded once even if it passes through nested calls
+                    breaker.on_failure()
+                    budget.on_failure()
+                    e._failure_recorded = True
+                delay = backoff_delay(attempt)
+                if (
+                    attempt >= max_attempts
+                    or not budget.allows_retry()
+                    or (remaining is not None and delay >= remaining)
+                ):
+                    raise
+                logger.warning(
+                    f"Attempt {attempt}/{max_attempts} to {url} failed: "
+                    f"{type(e).__name__}: {e}, "
+                    f"retrying in {delay:.1f}s"
+                )
+                metrics.incr("http.retries")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # cancelled, the next call may probe instead
+                breaker.probing = False
+                raise
+            breaker.on_success()
+            budget.on_success()
+            return result
+    finally:
+        _retrying.reset(token)
@@ -1,21 +1,77 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
 async def retrieve_docs(user_query, k_code=2, k_doc=1, k_summary=1):
+    """Embeds the query once and fetches top-k code, documentation and summary
+    documents in a single round trip"""
+    from backend.workflow.utils.HFSpace.hf_space_wrapper import CustomEmbedding
+
     query = _get_detailed_instruct(user_query)
-    code_docs = await _retrieve_docs(query, k=k_code, type="code")
-    docstrings = await _retrieve_docs(query, k=k_doc, type="documentation")
-    summary_docs = await _retrieve_docs(query, k=k_summary, type="summary")
-    return code_docs + docstrings + summary_docs
+    ks = {"code": k_code, "documentation": k_doc, "summary": k_summary}
+    ks = {type: k for type, k in ks.items() if k > 0}
+    if not ks:
+        return []
 
+    embed_service = CustomEmbedding()
+    query_embedding = await embed_service.embed_query(query)
+    return await _search_by_embedding(query_embedding, ks)
 
-def format_retrieved_docs(docs):
-    content = ""
-    for i, (doc, score) in enumerate(docs, 1):
-        content += "=" * 15 + f"Block {i}" + "=" * 15 + "\n"
-        content += f"Relevance Score: {score}\n\n"
-        content += doc.page_content + "\n"
-        content += "\nMetadata:\n"
-        for k, v in doc.metadata.items():
-            content += f"{k}: {v}\n"
-    return content
+
+async def retrieve_docs_batch(requests, concurrency=None):
+    """Retrieves documents for several queries at once.
+    `requests` is a list of (user_query, {type: k}). All queries are embedded in
+    one batch request and the searches run concurrently, each on its own pooled
+    connection (at most `concurrency` at a time if given). Returns one
+    List[Tuple[Document, float]] per request, empty if its embedding failed.
+    """
+    import asyncio
+    import contextlib
+
+    from backend.workflow.utils.HFSpace.hf_space_wrapper import CustomEmbedding
+
+    requests = [
+        (query, {type: k for type, k in ks.items() if k > 0}) for query, ks in requests
+    ]
+    queries = [_get_detailed_instruct(query) for query, ks in requests if ks]
+    embed_service = CustomEmbedding()
+    embeddings = iter(await embed_service.embed_queries(queries))
+    if concurrency:
+        semaphore = asyncio.Semaphore(concurrency)
+    else:
+        semaphore = contextlib.nullcontext()
+
+    async def search(query_embedding, ks):
+        if not ks or not query_embedding:
+            return []
+        async with semaphore:
+            return await _search_by_embedding(query_embedding, ks)
+
+    return await asyncio.gather(
+        *(search(next(embeddings) if ks else None, ks) for _, ks in requests)
+    )
+
+
+def format_retrieved_docs(docs, token_budget=None):
+    """Packs retrieved documents into prompt context within a token budget,
+    see context_packer.pack_retrieved_docs"""
+    from backend.workflow.utils.context_packer import (
+        CONTEXT_TOKEN_BUDGET,
+        pack_retrieved_docs,
+    )
+
+    packed = pack_retrieved_docs(docs, token_budget or CONTEXT_TOKEN_BUDGET)
+    logger.debug(
+        "Packed %d documents into %d tokens, saved %d tokens "
+        "(%d duplicates, %d over budget dropped)",
+        len(docs),
+        packed.tokens,
+        packed.tokens_saved,
+        packed.duplicates_dropped,
+        packed.over_budget_dropped,
+    )
+    return packed.text
 
 
 def _get_detailed_instruct(query: str) -> str:
@@ -26,65 +82,105 @@ Given a query, retrieve relevant documents that answer the query
     return f"Instruct: {task_description}\nQuery:{query}"
 
 
-async def _get_pg_engine():
-    import os
-
-    from dotenv import load_dotenv
-
-    load_dotenv()
-
-    POSTGRES_USER = os.getenv("POSTGRES_USER")
-    POSTGRES_HOST = os.getenv("POSTGRES_HOST")
-    POSTGRES_DB = os.getenv("POSTGRES_DB")
-    POSTGRES_PORT = os.getenv("POSTGRES_PORT")
+async def _search_by_embedding(query_embedding, ks: dict):
+    """Fetches top-k documents for every type in `ks` ({type: k}).
+    Rows are served from the retrieval cache when the same (embedding, type, k)
+    was already looked up for the current corpus version, the remaining types
+    are fetched in a single pgvector query or from the in-process numpy index
+    (RETRIEVAL_BACKEND).
+    Returns List[Tuple[Document, float]] grouped by type in the order of `ks`,
+    most similar first.
+    """
+    from langchain_core.documents import Document
 
-    CONNECTION_STRING = (
-        f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_HOST}"
-        f":{POSTGRES_PORT}/{POSTGRES_DB}"
+    from backend.workflow.utils.cache import get_retrieval_cache
+    from backend.workflow.utils.corpus_version import get_corpus_version
+    from backend.workflow.utils.vector_index import (
+        RETRIEVAL_BACKEND,
+        load_vector_index,
+        search_vector_index,
     )
 
-    from langchain_postgres import PGEngine
+    cache = get_retrieval_cache()
+    if RETRIEVAL_BACKEND == "numpy":
+        # resolved once, the cache key and the search use the same export
+        index = await load_vector_index()
+        version = index.version
+    else:
+        version = await get_corpus_version()
+    embedding_hash = cache.embedding_hash(query_embedding)
+
+    rows_by_type = {}
+    missing = {}
+    for type, k in ks.items():
+        rows = cache.get((embedding_hash, type, k, version))
+        if rows is None:
+            missing[type] = k
+        else:
+            rows_by_type[type] = rows
+
+    if missing:
+        if RETRIEVAL_BACKEND == "numpy":
+            version, fetched = await search_vector_index(
+                query_embedding, missing, index
+            )
+        else:
+            fetched = await _query_pgvector(query_embedding, missing)
+        for type, k in missing.items():
+            rows = fetched.get(type, [])
+            cache.set((embedding_hash, type, k, version), rows)
+            rows_by_type[type] = rows
+
+    docs = []
+    for type in ks:
+        for content, metadata, similarity_score in rows_by_type[type]:
+            doc = Document(page_content=content, metadata=dict(metadata))
+            docs.append((doc, similarity_score))
 
-    pg_engine = PGEngine.from_connection_string(url=CONNECTION_STRING)
-    return pg_engine
+    return docs
 
 
-async def _retrieve_docs(query, k=2, type="code"):
-    """Retrieve documents of specific type for a given query.
-    Returns List[Tuple[Document: str, metadata: dict]]: list of Document objects
-    with similarity score.
+async def _query_pgvector(query_embedding, ks: dict):
+    """Fetches top-k rows for every type in `ks` with one SQL statement. Each
+    type is its own ORDER BY/LIMIT branch of a UNION ALL so every branch can use
+    the partial HNSW index of its type, optionally on quantized vectors with
+    exact rescoring (see pg_indexes).
+    Returns {type: [(content, metadata, similarity_score)]}, most similar first.
     """
-    from langchain_core.documents import Document
     from sqlalchemy import text
 
-    from backend.workflow.utils.HFSpace.hf_space_wrapper import CustomEmbedding
-
-    embed_service = CustomEmbedding()
-
-    pg_engine = await _get_pg_engine()
+    from backend.workflow.utils.pg_engine import pg_connection
+    from backend.workflow.utils.pg_indexes import (
+        ef_search_for,
+        get_type_column,
+        search_branch_params,
+        search_branch_sql,
+    )
 
-    query_embedding = await embed_service.embed_query(query)
     embedding_str = f"[{','.join(map(str, query_embedding))}]"
-
-    sql_query = """
-    select langchain_id, content, embedding, langchain_metadata,
-    (embedding <=> CAST(:query_embedding AS vector)) as distance
-    from public.manim_docs
-    where langchain_metadata->>'type'=:type
-    order by distance
-    limit :k;
-    """
-
-    async with pg_engine._pool.connect() as conn:
-        result = await conn.execute(
-            text(sql_query), {"query_embedding": embedding_str, "type": type, "k": k}
-        )
+    type_column = await get_type_column()
+
+    types = list(ks)
+    params = {"query_embedding": embedding_str}
+    branches = []
+    for i, (type, k) in enumerate(ks.items()):
+        branches.append(search_branch_sql(i, type, type_column))
+        params.update(search_branch_params(i, k))
+
+    sql_query = "\n    union all".join(branches)
+    sql_query += "\n    order by type_order, distance;"
+
+    async with pg_connection() as conn:
+        # SET LOCAL only lasts for this transaction, rolled back on checkin
+        ef_search = ef_search_for(max(ks.values()))
+        await conn.execute(text(f"SET LOCAL hnsw.ef_search = {ef_search}"))
+        result = await conn.execute(text(sql_query), params)
         rows = result.fetchall()
 
-    docs = []
+    rows_by_type = {type: [] for type in types}
     for row in rows:
-        doc = Document(page_content=row.content, metadata=row.langchain_metadata)
-        similarity_score = 1 - row.distance
-        docs.append((doc, similarity_score))
+        rows_by_type[types[row.type_order]].append(
+            (row.content, row.langchain_metadata, 1 - row.distance)
+        )
 
-    return docs
+    return rows_by_type
@@ -0,0 +1,218 @@
+"""Exact and prefix lookup of Manim class and function names.
+
+Built at ingest time from the autosummary blocks of the summary documents and
+stored in postgres next to the embeddings, so every backend worker reads the
+index of the corpus it searches; it is reloaded when the corpus version
+changes. `fetch_summary` answers a query that is just a symbol name (or dotted
+path) from this index, the symbol hits of longer queries are merged with the
+vector search results.
+"""
+
+import asyncio
+import bisect
+import json
+import logging
+import re
+
+from langchain_core.documents import Document
+from sqlalchemy import text
+
+from backend.workflow.utils.corpus_version import EMBEDDINGS_TABLE, get_corpus_version
+from backend.workflow.utils.pg_engine import pg_connection
+
+logger = logging.getLogger(__name__)
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS public.symbol_indexes(
+    corpus VARCHAR(100) PRIMARY KEY,
+    symbol_index JSONB NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# Shortest single-word query answered by prefix lookup
+MIN_PREFIX_LENGTH = 3
+
+_IDENTIFIER = re.compile(r"~?[A-Za-z_][A-Za-z0-9_.]*")
+
+
+def _symbol_name(token: str) -> str | None:
+    """`~mobject.text.tex_mobject.MathTex` -> `MathTex`"""
+    name = token.lstrip("~").rstrip(".").rsplit(".", 1)[-1]
+    return name if name.isidentifier() else None
+
+
+def is_symbol_query(query: str) -> bool:
+    """Whether the whole query is a single identifier or dotted path"""
+    return bool(_IDENTIFIER.fullmatch(query.strip()))
+
+
+def _summary_symbols(content: str):
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith(":"):
+            continue
+        if _IDENTIFIER.fullmatch(line):
+            name = _symbol_name(line)
+            if name:
+                yield name
+
+
+def build_symbol_index(documents: list[Document]) -> dict:
+    """Maps symbol names to the summary documents that list them"""
+    docs = []
+    symbols = {}
+    for doc in documents:
+        if doc.metadata.get("type") != "summary":
+            continue
+        names = list(dict.fromkeys(_summary_symbols(doc.page_content)))
+        if not names:
+            continue
+        docs.append({"content": doc.page_content, "metadata": doc.metadata})
+        for name in names:
+            symbols.setdefault(name, []).append(len(docs) - 1)
+    return {"docs": docs, "symbols": symbols}
+
+
+async def write_symbol_index(documents: list[Document]):
+    """Stores the symbol index of the ingested documents, read by the backend
+    once the corpus version is bumped"""
+    index = build_symbol_index(documents)
+    async with pg_connection() as conn:
+        await conn.execute(text(_CREATE_TABLE))
+        await conn.execute(
+            text(
+                """
+                INSERT INTO public.symbol_indexes (corpus, symbol_index)
+                VALUES (:corpus, CAST(:symbol_index AS jsonb))
+                ON CONFLICT (corpus) DO UPDATE
+                SET symbol_index = excluded.symbol_index, updated_at = now();
+                """
+            ),
+            {"corpus": EMBEDDINGS_TABLE, "symbol_index": json.dumps(index)},
+        )
+        await conn.commit()
+    logger.info(
+        f"Stored symbol index of {EMBEDDINGS_TABLE} with "
+        f"{len(index['symbols'])} symbols"
+    )
+
+
+class SymbolIndex:
+    def __init__(self, index: dict, version: int):
+        self.version = version
+        self.docs = index["docs"]
+        self.symbols = index["symbols"]
+        self.lower = {}
+        for name in self.symbols:
+            self.lower.setdefault(name.lower(), []).append(name)
+        # sorted lowercase names for prefix search with bisect
+        self.sorted_names = sorted(self.lower)
+
+    def exact(self, name: str, ignore_case=False) -> list[str]:
+        if name in self.symbols:
+            return [name]
+        if ignore_case:
+            return self.lower.get(name.lower(), [])
+        return []
+
+    def prefix(self, prefix: str) -> list[str]:
+        prefix = prefix.lower()
+        names = []
+        i = bisect.bisect_left(self.sorted_names, prefix)
+        while i < len(self.sorted_names) and self.sorted_names[i].startswith(prefix):
+            names += self.lower[self.sorted_names[i]]
+            i += 1
+        return names
+
+    def lookup(self, query: str, limit: int = 3):
+        """Returns List[Tuple[Document, float]] for the symbols named in the
+        query, empty if there is none. A single-word query is matched ignoring case and then by prefix, longer
+        queries only match names spelled exactly as in the index."""
+        tokens = [t for t in map(_symbol_name, _IDENTIFIER.findall(query)) if t]
+        if not tokens:
+            return []
+
+        matches = []  # (name, score)
+        if len(tokens) == 1:
+            names = self.exact(tokens[0], ignore_case=True)
+            matches = [(name, 1.0) for name in names]
+            if not matches and len(tokens[0]) >= MIN_PREFIX_LENGTH:
+                matches = [(name, 0.9) for name in sorted(self.prefix(tokens[0]))]
+        else:
+            for token in tokens:
+                matches += [(name, 1.0) for name in self.exact(token)]
+
+        results = []
+        seen = set()
+        for name, score in matches:
+            for doc_idx in self.symbols[name]:
+                if doc_idx in seen:
+                    continue
+                doc = self.docs[doc_idx]
+                seen.add(doc_idx)
+                results.append(
+                    (
+                        Document(
+                            page_content=doc["content"],
+                            metadata=dict(doc["metadata"]),
+                        ),
+                        score,
+                    )
+                )
+        return results[:limit]
+
+
+_symbol_index = None
+_symbol_index_lock = asyncio.Lock()
+
+
+async def _load_symbol_index(version: int) -> SymbolIndex | None:
+    async with pg_connection() as conn:
+        # the table doesn't exist until the first ingestion
+        result = await conn.execute(
+            text("select to_regclass('public.symbol_indexes') is not null")
+        )
+        if not result.scalar():
+            return None
+        result = await conn.execute(
+            text(
+                "select symbol_index::text from public.symbol_indexes "
+                "where corpus=:corpus"
+            ),
+            {"corpus": EMBEDDINGS_TABLE},
+        )
+        data = result.scalar()
+    if data is None:
+        return None
+    return await asyncio.to_thread(lambda: SymbolIndex(json.loads(data), version))
+
+
+async def get_symbol_index() -> SymbolIndex | None:
+    """Returns the process-wide SymbolIndex, reloaded when the corpus version
+    changes. None if ingestion hasn't stored one yet."""
+    global _symbol_index
+    version = await get_corpus_version()
+    if _symbol_index is not None and _symbol_index.version == version:
+        return _symbol_index
+    async with _symbol_index_lock:
+        if _symbol_index is None or _symbol_index.version != version:
+            _symbol_index = await _load_symbol_index(version)
+            if _symbol_index is not None:
+                logger.info(
+                    f"Loaded symbol index with {len(_symbol_index.symbols)} names"
+                )
+        return _symbol_index
+
+
+async def lookup_symbols(query: str, limit: int = 3):
+    """Symbol index lookup, empty list on a miss, without an index or if it
+    can't be read (vector search answers instead)"""
+    try:
+        index = await get_symbol_index()
+    except Exception as e:
+        logger.warning(f"Couldn't load symbol index: {e!r}")
+        return []
+    if index is None:
+        return []
+    return index.lookup(query, limit)
@@ -0,0 +1,238 @@
+"""In-process exact vector search over an exported copy of the embeddings table.
+
+The corpus is small (a few thousand chunks), so a brute-force scan over a
+memory-mapped float16 matrix is cheaper than a postgres round trip. The matrix
+is opened with mmap, so every uvicorn worker on a host shares the same pages.
+
+Every export is written to its own directory under versions/ and published by
+replacing the CURRENT file, so the matrix and the sidecar always match.
+
+Export (re-run after every ingestion):
+    python -m backend.workflow.utils.vector_index
+
+Enable with RETRIEVAL_BACKEND=numpy, VECTOR_INDEX_DIR points to the export.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# "postgres" (default) or "numpy"
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "postgres")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", ".vector_index")
+
+EMBEDDINGS_FILE = "embeddings.npy"
+SIDECAR_FILE = "sidecar.json"
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+# Rows scored per matmul, bounds the float32 copy of the float16 matrix
+SEARCH_BLOCK_ROWS = 1024
+
+
+class NumpyVectorIndex:
+    """Exact cosine top-k search over a memory-mapped, L2 normalized float16
+    matrix. Rows are grouped by type, the sidecar stores the [start, end) row
+    range of every type along with content and metadata of each row."""
+
+    def __init__(self, path: str, export: str):
+        self.path = path
+        self.export = export
+        export_dir = os.path.join(path, VERSIONS_DIR, export)
+        with open(os.path.join(export_dir, SIDECAR_FILE)) as f:
+            sidecar = json.load(f)
+        self.types = {t: tuple(bounds) for t, bounds in sidecar["types"].items()}
+        self.rows = sidecar["rows"]
+        self.corpus_version = sidecar.get("corpus_version", 0)
+        self.matrix = np.load(os.path.join(export_dir, EMBEDDINGS_FILE), mmap_mode="r")
+        if len(self.matrix) != len(self.rows):
+            raise ValueError(
+                f"Vector index {export_dir} has {len(self.matrix)} embeddings "
+                f"for {len(self.rows)} rows"
+            )
+        # retrieval cache version, changes with every export
+        self.version = f"numpy:{self.corpus_version}:{export}"
+
+    def _scores(self, query: np.ndarray, start: int, end: int) -> np.ndarray:
+        """Similarity of rows [start, end), upcast one block at a time"""
+        scores = np.empty(end - start, dtype=np.float32)
+        for block in range(start, end, SEARCH_BLOCK_ROWS):
+            block_end = min(block + SEARCH_BLOCK_ROWS, end)
+            rows = self.matrix[block:block_end].astype(np.float32)
+            scores[block - start : block_end - start] = rows @ query
+        return scores
+
+    def search(self, query_embedding, ks: dict):
+        """Returns {type: [(content, metadata, similarity_score)]} with the
+        top-k rows of every type in `ks`, most similar first."""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        results = {}
+        for type, k in ks.items():
+            # types are contiguous slices of the matrix, only these are scored
+            start, end = self.types.get(type, (0, 0))
+            k = min(k, end - start)
+            if k <= 0:
+                results[type] = []
+                continue
+            type_scores = self._scores(query, start, end)
+            top = np.argpartition(-type_scores, k - 1)[:k]
+            top = top[np.argsort(-type_scores[top])]
+            results[type] = [
+                (
+                    self.rows[start + i]["content"],
+                    self.rows[start + i]["metadata"],
+                    float(type_scores[i]),
+                )
+                for i in top
+            ]
+        return results
+
+
+def _current_export(path: str) -> str:
+    with open(os.path.join(path, CURRENT_FILE)) as f:
+        return f.read().strip()
+
+
+_vector_index = None
+_vector_index_lock = threading.Lock()
+
+
+def get_vector_index(path: str | None = None) -> NumpyVectorIndex:
+    """Returns the process-wide index, reloaded when the export changes"""
+    global _vector_index
+    path = path or VECTOR_INDEX_DIR
+    export = _current_export(path)
+    with _vector_index_lock:
+        if (
+            _vector_index is None
+            or _vector_index.path != path
+            or _vector_index.export != export
+        ):
+            _vector_index = NumpyVectorIndex(path, export)
+            logger.info(
+                f"Loaded vector index with {len(_vector_index.rows)} rows "
+                f"(corpus version {_vector_index.corpus_version})"
+            )
+        return _vector_index
+
+
+async def load_vector_index(path: str | None = None) -> NumpyVectorIndex:
+    """Runs get_vector_index off the event loop, it reads CURRENT and loads a
+    new export"""
+    return await asyncio.to_thread(get_vector_index, path)
+
+
+async def search_vector_index(
+    query_embedding, ks: dict, index: NumpyVectorIndex | None = None
+):
+    """Runs NumpyVectorIndex.search off the event loop, on `index` or the
+    current one. Returns (index version, rows) so results are cached under the
+    version of the export they came from."""
+
+    def search():
+        searched = index or get_vector_index()
+        return searched.version, searched.search(query_embedding, ks)
+
+    return await asyncio.to_thread(search)
+
+
+def write_vector_index(path: str, rows: list, corpus_version: int = 0):
+    """Writes rows [(embedding, content, metadata)] as an index to `path`.
+    The export goes to a new directory under versions/ and is published by
+    replacing CURRENT with os.replace, so running workers never observe a
+    partial export. Exports older than the previous one are removed."""
+    versions = os.path.join(path, VERSIONS_DIR)
+    os.makedirs(versions, exist_ok=True)
+    export_dir = tempfile.mkdtemp(prefix="v", dir=versions)
+    os.chmod(export_dir, 0o755)  # mkdtemp makes it private
+    rows = sorted(rows, key=lambda row: row[2].get("type", ""))
+
+    dim = len(rows[0][0]) if rows else 0
+    matrix = np.lib.format.open_memmap(
+        os.path.join(export_dir, EMBEDDINGS_FILE),
+        mode="w+",
+        dtype=np.float16,
+        shape=(len(rows), dim),
+    )
+    types = {}
+    sidecar_rows = []
+    for i, (embedding, content, metadata) in enumerate(rows):
+        vector = np.asarray(embedding, dtype=np.float32)
+        matrix[i] = vector / (np.linalg.norm(vector) or 1.0)
+        type = metadata.get("type", "")
+        start, _ = types.get(type, (i, i))
+        types[type] = (start, i + 1)
+        sidecar_rows.append({"content": content, "metadata": metadata})
+    matrix.flush()
+    del matrix
+
+    with open(os.path.join(export_dir, SIDECAR_FILE), "w") as f:
+        json.dump(
+            {"corpus_version": corpus_version, "types": types, "rows": sidecar_rows},
+            f,
+        )
+
+    try:
+        previous = _current_export(path)
+    except FileNotFoundError:
+        previous = None
+    export = os.path.basename(export_dir)
+    tmp_current = os.path.join(path, CURRENT_FILE + ".tmp")
+    with open(tmp_current, "w") as f:
+        f.write(export)
+    os.replace(tmp_current, os.path.join(path, CURRENT_FILE))
+    # the previous export stays for workers that are just loading it
+    for name in os.listdir(versions):
+        if name not in (export, previous):
+            shutil.rmtree(os.path.join(versions, name), ignore_errors=True)
+    logger.info(f"Wrote vector index with {len(rows)} rows to {export_dir}")
+
+
+async def export_vector_index(path: str | None = None):
+    """Exports embeddings, content and metadata of the embeddings table"""
+    from sqlalchemy import text
+
+    from backend.workflow.utils.corpus_version import get_corpus_version
+    from backend.workflow.utils.pg_engine import pg_connection
+
+    async with pg_connection() as conn:
+        result = await conn.execute(
+            text(
+                "select content, embedding::text as embedding, langchain_metadata "
+                "from public.manim_docs"
+            )
+        )
+        rows = [
+            (json.loads(row.embedding), row.content, row.langchain_metadata)
+            for row in result.fetchall()
+        ]
+    write_vector_index(
+        path or VECTOR_INDEX_DIR, rows, corpus_version=await get_corpus_version()
+    )
+
+
+if __name__ == "__main__":
+    from backend.workflow.utils.logging_config import configure_logging
+    from backend.workflow.utils.pg_engine import close_pg_engine
+
+    configure_logging()
+
+    async def _main():
+        try:
+            await export_vector_index()
+        finally:
+            await close_pg_engine()
+
+    asyncio.run(_main())
@@ -1,34 +1,47 @@
+import base64
 import logging
-from typing import List, Optional, Union
+from typing import List, Literal, Optional, Union
 
+import metrics
 import numpy as np
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
+from inference import INFERENCE_MODE, InvalidRequest, create_inference
+from pydantic import BaseModel, Field
+from registry import DEFAULT_MODEL, ModelNotAllowed
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Embedding API", version="1.0.0")
 
-# Load model at startup
-model = None
-model_name = None
+inference = None
 
 
 @app.on_event("startup")
 async def startup_event():
-    global model, model_name
-    logger.info("Loading embedding model...")
-    # Default model
-    model = SentenceTransformer("Qwen/Qwen3-Embedding-0.6B")
-    model_name = "Qwen/Qwen3-Embedding-0.6B"
-    logger.info("Model loaded successfully!")
+    global inference
+    # Default model, loaded here or by the inference process
+    inference = create_inference()
+    await inference.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if inference is not None:
+        await inference.close()
 
 
 class EmbeddingRequest(BaseModel):
     input: Union[str, List[str]]
-    model: Optional[str] = "Qwen/Qwen3-Embedding-0.6B"
+    model: Optional[str] = DEFAULT_MODEL
+    # "float" (JSON lists) or "base64" (packed little-endian floats, as OpenAI)
+    encoding_format: Literal["float", "base64"] = "float"
+    # element type of base64 embeddings, float16 halves the payload again
+    embedding_dtype: Literal["float32", "float16"] = "float32"
+    # truncate inputs to this many tokens (default: the model's max_seq_length)
+    max_tokens: Optional[int] = Field(None, ge=1)
+    # Matryoshka output size, embeddings are truncated and renormalized
+    dimensions: Optional[int] = Field(None, ge=1)
 
 
 class EmbeddingResponse(BaseModel):
@@ -38,40 +51,56 @@ class EmbeddingResponse(BaseModel):
     usage: dict
 
 
+def encode_embedding(
+    embedding: np.ndarray, encoding_format: str, embedding_dtype: str
+) -> Union[List[float], str]:
+    if encoding_format == "base64":
+        dtype = "<f2" if embedding_dtype == "float16" else "<f4"
+        return base64.b64encode(embedding.astype(dtype).tobytes()).decode("ascii")
+    return embedding.tolist()
+
+
 @app.post("/v1/embeddings")
-def create_embeddings(request: EmbeddingRequest):
-    if model is None:
+async def create_embeddings(request: EmbeddingRequest):
+    if inference is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
 
     try:
-        local_model = model
-        local_model_name = model_name
-        if model_name != request.model:
-            local_model = SentenceTransformer(request.model)
-            logger.info("Loaded model: " + request.model)
-            local_model_name = request.model
         # Handle both single string and list of strings
         texts = [request.input] if isinstance(request.input, str) else request.input
 
-        # Generate embeddings
-        embeddings = local_model.encode(texts, convert_to_numpy=True)
+        # Generate embeddings, batched with concurrent requests
+        model_name, embeddings = await inference.embed(
+            request.model or DEFAULT_MODEL,
+            texts,
+            request.max_tokens,
+            request.dimensions,
+        )
 
         # Format response in OpenAI-compatible format
         data = []
         for idx, embedding in enumerate(embeddings):
             data.append(
-                {"object": "embedding", "embedding": embedding.tolist(), "index": idx}
+                {
+                    "object": "embedding",
+                    "embedding": encode_embedding(
+                        embedding, request.encoding_format, request.embedding_dtype
+                    ),
+                    "index": idx,
+                }
             )
 
         return EmbeddingResponse(
             data=data,
-            model=local_model_name,
+            model=model_name,
             usage={
                 "prompt_tokens": sum(len(text.split()) for text in texts),
                 "total_tokens": sum(len(text.split()) for text in texts),
             },
         )
 
+    except (ModelNotAllowed, InvalidRequest) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating embeddings: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -82,10 +111,24 @@ async def root():
     return {"message": "Embedding API is running", "endpoint": "/v1/embeddings"}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    # batching metrics live in the process running the models
+    if inference is not None:
+        return await inference.metrics()
+    return metrics.snapshot()
+
+
 @app.get("/health")
 async def health():
+    try:
+        details = await inference.health() if inference is not None else {}
+    except Exception as e:
+        logger.error(f"Inference process unavailable: {e}")
+        return {"status": "unhealthy", "model_name": DEFAULT_MODEL}
     return {
         "status": "healthy",
-        "model_name": model_name,
-        "model_loaded": model is not None,
+        "model_name": DEFAULT_MODEL,
+        "inference_mode": INFERENCE_MODE,
+        **details,
     }
@@ -0,0 +1,152 @@
+"""Cross-request micro-batching.
+
+Requests are queued and grouped until MAX_BATCH_SIZE texts or MAX_BATCH_WAIT_MS
+after the first one; each group runs as a single encode of its unique texts
+(one per distinct max_tokens) and every request gets back the rows of its own
+texts.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import metrics
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "64"))
+MAX_BATCH_WAIT_MS = float(os.getenv("MAX_BATCH_WAIT_MS", "5"))
+
+
+@dataclass
+class _Request:
+    texts: List[str]
+    max_tokens: Optional[int]
+    future: asyncio.Future
+
+
+class BatchScheduler:
+    def __init__(
+        self,
+        encode: Callable[[List[str], Optional[int]], np.ndarray],
+        name: str = "default",
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_BATCH_WAIT_MS,
+    ):
+        self.encode = encode
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # one encode at a time, torch already uses all cores for a batch
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+        self._stopped = False
+        self._pending = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self, drain: bool = False):
+        """Stops the scheduler, after answering the queued requests if `drain`.
+        Requests still queued or arriving afterwards fail."""
+        while drain and self._pending:
+            await self._idle.wait()
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for future in self._pending:
+            if not future.done():
+                future.set_exception(RuntimeError(f"Model {self.name} was unloaded"))
+        self._executor.shutdown(wait=False)
+
+    async def embed(
+        self, texts: List[str], max_tokens: Optional[int] = None
+    ) -> np.ndarray:
+        """Embeddings of `texts` (one row per text, truncated to `max_tokens`),
+        batched with the texts of concurrent requests"""
+        if self._stopped:
+            raise RuntimeError(f"Model {self.name} was unloaded")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.add(future)
+        self._idle.clear()
+        try:
+            await self._queue.put(_Request(texts, max_tokens, future))
+            return await future
+        finally:
+            self._pending.discard(future)
+            if not self._pending:
+                self._idle.set()
+
+    async def _next_batch(self) -> List[_Request]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        size = len(batch[0].texts)
+        deadline = loop.time() + self.max_wait
+        while size < self.max_batch_size:
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                request = self._queue.get_nowait()
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    async def _encode_groups(self, batch: List[_Request]) -> Dict:
+        """{(max_tokens, text): embedding} for the unique texts of the batch"""
+        loop = asyncio.get_running_loop()
+        groups: Dict[Optional[int], List[str]] = {}
+        for request in batch:
+            groups.setdefault(request.max_tokens, []).extend(request.texts)
+        rows = {}
+        for max_tokens, texts in groups.items():
+            unique = list(dict.fromkeys(texts))
+            embeddings = await loop.run_in_executor(
+                self._executor, self.encode, unique, max_tokens
+            )
+            rows.update(((max_tokens, t), e) for t, e in zip(unique, embeddings))
+        return rows
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            batch = [request for request in batch if not request.future.done()]
+            if not batch:
+                continue
+            texts = [text for request in batch for text in request.texts]
+            unique = {(r.max_tokens, text) for r in batch for text in r.texts}
+            metrics.observe("batch.queue_depth", self._queue.qsize())
+            metrics.observe("batch.requests", len(batch))
+            metrics.observe("batch.size", len(unique))
+            metrics.incr("batch.duplicate_texts", len(texts) - len(unique))
+
+            try:
+                rows = await self._encode_groups(batch)
+            except Exception as e:
+                logger.error(f"Batch of {len(unique)} texts failed: {e}")
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_result(
+                        np.stack([rows[(request.max_tokens, t)] for t in request.texts])
+                    )
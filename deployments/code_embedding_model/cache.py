@@ -0,0 +1,203 @@
+"""Persistent embedding cache.
+
+Embeddings are stored in an SQLite database (EMBEDDING_CACHE_PATH, read through
+mmap) keyed by model, dimensions, max_tokens and the sha256 of the text, so
+unchanged texts (re-ingestion, repeated queries) cost no inference, across
+restarts too. The least recently used entries are evicted once the vectors
+exceed EMBEDDING_CACHE_MAX_MB. An empty EMBEDDING_CACHE_PATH disables it, which
+benchmarks of the inference itself (thread_benchmark.py) must do.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import metrics
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "embedding_cache.sqlite3"),
+)
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+
+# eviction goes this far below the cap, so it doesn't run on every write
+_EVICT_TO = 0.9
+# below SQLite's limit of query parameters
+_CHUNK = 500
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        path: str = EMBEDDING_CACHE_PATH,
+        max_bytes: int = EMBEDDING_CACHE_MAX_MB * 2**20,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        # one thread owns the connection, writes are applied in order
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._db = None
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._open)
+        logger.info(
+            f"Embedding cache {self.path}: {self._size / 2**20:.0f} MiB "
+            f"of {self.max_bytes / 2**20:.0f} MiB"
+        )
+
+    async def close(self):
+        if self._db is not None:
+            self._executor.submit(self._db.close)
+        self._executor.shutdown(wait=True)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(f"PRAGMA mmap_size={2 * self.max_bytes}")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, dimensions INTEGER, "
+            "max_tokens INTEGER, hash BLOB, vector BLOB, last_used REAL)"
+        )
+        db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS embeddings_key "
+            "ON embeddings (model, dimensions, max_tokens, hash)"
+        )
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        db.commit()
+        self._db = db
+        self._size = self._stored_bytes()
+
+    def _stored_bytes(self) -> int:
+        query = "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        return self._db.execute(query).fetchone()[0]
+
+    async def get(
+        self, model: str, dimensions: int, max_tokens: int, texts: List[str]
+    ) -> List[Optional[np.ndarray]]:
+        """The cached embedding of every text, None for the ones not cached"""
+        found = await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._get, model, dimensions, max_tokens, texts
+        )
+        hits = sum(e is not None for e in found)
+        self.hits += hits
+        self.misses += len(found) - hits
+        metrics.incr("cache.hits", hits)
+        metrics.incr("cache.misses", len(found) - hits)
+        return found
+
+    def _get(self, model, dimensions, max_tokens, texts):
+        hashes = [hashlib.sha256(text.encode()).digest() for text in texts]
+        unique = list(dict.fromkeys(hashes))
+        vectors = {}
+        for start in range(0, len(unique), _CHUNK):
+            chunk = unique[start : start + _CHUNK]
+            rows = self._db.execute(
+                "SELECT hash, vector FROM embeddings WHERE model = ? AND "
+                "dimensions = ? AND max_tokens = ? AND hash IN "
+                f"({', '.join('?' * len(chunk))})",
+                (model, dimensions, max_tokens, *chunk),
+            )
+            vectors.update(rows)
+        if vectors:
+            now = time.time()
+            with self._db:
+                self._db.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND "
+                    "dimensions = ? AND max_tokens = ? AND hash = ?",
+                    [(now, model, dimensions, max_tokens, h) for h in vectors],
+                )
+        return [
+            np.frombuffer(vectors[h], dtype="<f4") if h in vectors else None
+            for h in hashes
+        ]
+
+    def put(
+        self,
+        model: str,
+        dimensions: int,
+        max_tokens: int,
+        texts: List[str],
+        embeddings: np.ndarray,
+    ):
+        """Queues the embeddings to be written, without waiting for the write"""
+        future = self._executor.submit(
+            self._put, model, dimensions, max_tokens, texts, embeddings
+        )
+        future.add_done_callback(self._log_write_error)
+
+    @staticmethod
+    def _log_write_error(future):
+        if future.exception() is not None:
+            logger.error(f"Embedding cache write failed: {future.exception()!r}")
+
+    def _put(self, model, dimensions, max_tokens, texts, embeddings):
+        now = time.time()
+        rows = [
+            (
+                model,
+                dimensions,
+                max_tokens,
+                hashlib.sha256(text.encode()).digest(),
+                np.asarray(embedding, dtype="<f4").tobytes(),
+                now,
+            )
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, dimensions, max_tokens, "
+                "hash, vector, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        self._size += sum(len(row[4]) for row in rows)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        # other processes (INFERENCE_MODE=local workers) may share the file
+        self._size = self._stored_bytes()
+        excess = self._size - int(self.max_bytes * _EVICT_TO)
+        if excess <= 0:
+            return
+        rowids, freed = [], 0
+        rows = self._db.execute(
+            "SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used"
+        )
+        for rowid, size in rows:
+            rowids.append((rowid,))
+            freed += size
+            if freed >= excess:
+                break
+        rows.close()
+        with self._db:
+            self._db.executemany("DELETE FROM embeddings WHERE rowid = ?", rowids)
+        self._size -= freed
+        metrics.incr("cache.evictions", len(rowids))
+        logger.info(
+            f"Evicted {len(rowids)} cached embeddings ({freed / 2**20:.0f} MiB)"
+        )
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size_mb": round(self._size / 2**20, 1),
+            "max_mb": round(self.max_bytes / 2**20, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
@@ -0,0 +1,212 @@
+"""Inference engines for the embedding models.
+
+INFERENCE_ENGINE=torch (default) serves the full precision PyTorch model.
+INFERENCE_ENGINE=onnx-int8 exports the model to ONNX once, quantizes it with
+dynamic int8 quantization (cached in ONNX_CACHE_DIR) and serves it with ONNX
+Runtime. Before an int8 model is served, its embeddings of a validation set
+are compared with the PyTorch ones and loading fails (so the service doesn't
+start) if any cosine similarity is below PARITY_THRESHOLD.
+"""
+
+import logging
+import os
+import platform
+from bisect import bisect_left
+from typing import List, Optional
+
+import metrics
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from topology import ThreadTopology
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "torch")
+ONNX_CACHE_DIR = os.getenv(
+    "ONNX_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "onnx_models")
+)
+# arm64, avx2, avx512 or avx512_vnni; detected from the CPU when empty
+ONNX_QUANTIZATION_CONFIG = os.getenv("ONNX_QUANTIZATION_CONFIG", "")
+PARITY_THRESHOLD = float(os.getenv("PARITY_THRESHOLD", "0.98"))
+
+ENGINES = ("torch", "onnx-int8")
+
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "32"))
+# Upper token lengths of the length buckets, longer texts share the last one
+LENGTH_BUCKETS = tuple(
+    int(bound) for bound in os.getenv("LENGTH_BUCKETS", "32,64,128,256,512").split(",")
+)
+
+# Queries (with the client's instruct template) and documents like the ones
+# the service embeds in production
+_INSTRUCT = (
+    "Instruct: \nGiven a query, retrieve relevant documents that answer the "
+    "query\n\nQuery:"
+)
+PARITY_TEXTS = [
+    _INSTRUCT + "How do I animate a square turning into a circle?",
+    _INSTRUCT + "MathTex color a part of an equation",
+    _INSTRUCT + "camera zoom in MovingCameraScene",
+    "class SquareToCircle(Scene):\n    def construct(self):\n"
+    "        circle = Circle()\n        square = Square()\n"
+    "        self.play(Create(square))\n"
+    "        self.play(Transform(square, circle))",
+    "axes = Axes(x_range=[-3, 3], y_range=[-1, 9])\n"
+    "graph = axes.plot(lambda x: x**2, color=BLUE)",
+    "Animations\n==========\n\nAnimate mobjects. The animation classes are "
+    "used by Scene.play to interpolate mobjects over the run time.",
+    ".. autosummary::\n   :toctree: ../reference\n\n"
+    "   ~mobject.geometry.arc.Circle\n   ~mobject.geometry.polygram.Square",
+    "ValueTracker is a Mobject holding a number that can be animated; use "
+    "always_redraw or add_updater to make other mobjects follow its value.",
+    "def construct(self):\n    text = Text('Hello', font_size=72)\n"
+    "    self.play(Write(text))\n    self.wait()",
+    "Updaters are functions called every frame with the mobject and dt.",
+]
+
+_topology: Optional[ThreadTopology] = None
+
+
+def configure_threads(topology: ThreadTopology):
+    """Thread pools of the models loaded afterwards"""
+    global _topology
+    _topology = topology
+    torch.set_num_threads(topology.intra_op_threads)
+    try:
+        torch.set_num_interop_threads(topology.inter_op_threads)
+    except RuntimeError as e:  # only settable before any inter-op work
+        logger.warning(f"Could not set the inter-op threads: {e}")
+
+
+def _quantization_config() -> str:
+    if ONNX_QUANTIZATION_CONFIG:
+        return ONNX_QUANTIZATION_CONFIG
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return "avx2"
+    if "avx512_vnni" in flags:
+        return "avx512_vnni"
+    if "avx512f" in flags:
+        return "avx512"
+    return "avx2"
+
+
+def _load_onnx_int8(name: str) -> SentenceTransformer:
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    model_dir = os.path.join(ONNX_CACHE_DIR, name.replace("/", "--"))
+    file_name = "onnx/model_qint8.onnx"
+    if not os.path.exists(os.path.join(model_dir, file_name)):
+        config = _quantization_config()
+        logger.info(f"Exporting {name} to ONNX with {config} int8 quantization...")
+        onnx_model = SentenceTransformer(name, backend="onnx")
+        onnx_model.save(model_dir)
+        export_dynamic_quantized_onnx_model(
+            onnx_model, config, model_dir, file_suffix="qint8"
+        )
+    model_kwargs = {"file_name": file_name}
+    if _topology is not None:
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = _topology.intra_op_threads
+        options.inter_op_num_threads = _topology.inter_op_threads
+        model_kwargs["session_options"] = options
+    model = SentenceTransformer(model_dir, backend="onnx", model_kwargs=model_kwargs)
+    # the weights live in ONNX Runtime, not in torch parameters
+    model.onnx_size_bytes = os.path.getsize(os.path.join(model_dir, file_name))
+    return model
+
+
+def model_size_bytes(model: SentenceTransformer) -> int:
+    """Memory held by the model weights"""
+    if getattr(model, "onnx_size_bytes", None) is not None:
+        return model.onnx_size_bytes
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def encode(
+    model: SentenceTransformer, texts: List[str], max_tokens: Optional[int] = None
+) -> np.ndarray:
+    """Embeddings of `texts` (in order), truncated to `max_tokens` tokens.
+    Texts are bucketed by token length (LENGTH_BUCKETS) and every bucket is
+    encoded separately, so short texts aren't padded to the longest ones.
+    Not thread-safe, the batch scheduler runs one encode per model at a time."""
+    max_length = model.max_seq_length
+    if max_tokens is not None:
+        max_length = min(max_length, max_tokens)
+    token_ids = model.tokenizer(texts, verbose=False)["input_ids"]
+    lengths = [min(len(ids), max_length) for ids in token_ids]
+    buckets = {}
+    for i, length in enumerate(lengths):
+        buckets.setdefault(bisect_left(LENGTH_BUCKETS, length), []).append(i)
+
+    embeddings = [None] * len(texts)
+    padded_tokens = 0
+    default_max_length = model.max_seq_length
+    model.max_seq_length = max_length
+    try:
+        for _, indices in sorted(buckets.items()):
+            indices.sort(key=lambda i: lengths[i])
+            for start in range(0, len(indices), ENCODE_BATCH_SIZE):
+                chunk = indices[start : start + ENCODE_BATCH_SIZE]
+                padded_tokens += lengths[chunk[-1]] * len(chunk)
+            rows = model.encode(
+                [texts[i] for i in indices],
+                batch_size=ENCODE_BATCH_SIZE,
+                convert_to_numpy=True,
+            )
+            for i, row in zip(indices, rows):
+                embeddings[i] = row
+    finally:
+        model.max_seq_length = default_max_length
+
+    metrics.incr("encode.tokens", sum(lengths))
+    metrics.incr("encode.padded_tokens", padded_tokens)
+    return np.stack(embeddings)
+
+
+def truncate_dimensions(embeddings: np.ndarray, dimensions: int) -> np.ndarray:
+    """Matryoshka truncation: first `dimensions` components, renormalized"""
+    truncated = embeddings[:, :dimensions]
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    return truncated / np.maximum(norms, 1e-12)
+
+
+def check_parity(
+    reference: SentenceTransformer,
+    candidate: SentenceTransformer,
+    texts=PARITY_TEXTS,
+    threshold=PARITY_THRESHOLD,
+) -> float:
+    """Returns the lowest cosine similarity between the embeddings of both
+    models, raises if it is below `threshold`"""
+    expected = reference.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    actual = candidate.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    similarity = float(np.min(np.sum(expected * actual, axis=1)))
+    if similarity < threshold:
+        raise RuntimeError(
+            f"Embedding parity check failed: min cosine similarity "
+            f"{similarity:.4f} < {threshold}"
+        )
+    return similarity
+
+
+def load_model(name: str, engine: str = INFERENCE_ENGINE) -> SentenceTransformer:
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown inference engine {engine!r}, use one of {ENGINES}")
+    if engine == "torch":
+        return SentenceTransformer(name)
+
+    model = _load_onnx_int8(name)
+    reference = SentenceTransformer(name)
+    similarity = check_parity(reference, model)
+    del reference
+    logger.info(f"{name} int8 ONNX parity: min cosine similarity {similarity:.4f}")
+    return model
@@ -0,0 +1,337 @@
+"""Where the embedding models run.
+
+INFERENCE_MODE=local (default) loads the models in the HTTP worker process.
+With INFERENCE_MODE=socket a single inference process (`python inference.py`)
+owns them and serves every uvicorn worker over the unix socket
+INFERENCE_SOCKET: the workers only handle HTTP, there is one copy of each model
+in memory and the texts of all workers are batched together.
+
+Each worker keeps one connection, its concurrent requests are multiplexed on it
+by id. A frame is a 4 byte length, a JSON header and `nbytes` of body (the
+float32 embeddings of a response).
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import struct
+from dataclasses import asdict
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+import numpy as np
+from cache import EMBEDDING_CACHE_PATH, EmbeddingCache
+from registry import DEFAULT_MODEL, LoadedModel, ModelNotAllowed, ModelRegistry
+from topology import thread_topology
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "local")
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "/tmp/embedding-inference.sock")
+# How long a worker waits at startup for the inference process (model loading)
+INFERENCE_CONNECT_TIMEOUT = float(os.getenv("INFERENCE_CONNECT_TIMEOUT", "600"))
+
+MODES = ("local", "socket")
+
+
+class InvalidRequest(Exception):
+    pass
+
+
+def _frame(header: dict, body: bytes = b"") -> bytes:
+    header = json.dumps({**header, "nbytes": len(body)}).encode()
+    return struct.pack("!I", len(header)) + header + body
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Tuple[dict, bytes]:
+    (size,) = struct.unpack("!I", await reader.readexactly(4))
+    header = json.loads(await reader.readexactly(size))
+    return header, await reader.readexactly(header["nbytes"])
+
+
+class LocalInference:
+    """Models loaded in this process"""
+
+    def __init__(self):
+        self.engine = None
+        self.registry = None
+        self.topology = thread_topology(INFERENCE_MODE)
+        self.cache = EmbeddingCache() if EMBEDDING_CACHE_PATH else None
+
+    async def start(self):
+        self.topology.export_env()
+        # imported here so that socket mode workers don't load torch
+        import engine
+
+        self.engine = engine
+        engine.configure_threads(self.topology)
+        if self.cache is not None:
+            await self.cache.start()
+        logger.info(
+            f"Loading embedding model with the {engine.INFERENCE_ENGINE} engine..."
+        )
+        self.registry = ModelRegistry(
+            engine.load_model, engine.encode, engine.model_size_bytes
+        )
+        await self.registry.get(DEFAULT_MODEL)
+        logger.info("Model loaded successfully!")
+
+    async def close(self):
+        if self.registry is not None:
+            await self.registry.close()
+        if self.cache is not None:
+            await self.cache.close()
+
+    async def embed(
+        self,
+        model: str,
+        texts: List[str],
+        max_tokens: Optional[int] = None,
+        dimensions: Optional[int] = None,
+    ) -> Tuple[str, np.ndarray]:
+        """(model name, one embedding row per text)"""
+        async with self.registry.use(model) as entry:
+            return await self._embed(entry, texts, max_tokens, dimensions)
+
+    async def _embed(
+        self,
+        entry: LoadedModel,
+        texts: List[str],
+        max_tokens: Optional[int],
+        dimensions: Optional[int],
+    ) -> Tuple[str, np.ndarray]:
+        max_dimensions = entry.model.get_sentence_embedding_dimension()
+        if dimensions and dimensions > max_dimensions:
+            raise InvalidRequest(f"dimensions must be at most {max_dimensions}")
+        if not texts:
+            return entry.name, np.zeros((0, dimensions or max_dimensions), np.float32)
+
+        # the engine is part of the key, int8 embeddings differ from torch ones
+        key = (
+            f"{entry.name}@{self.engine.INFERENCE_ENGINE}",
+            dimensions or 0,
+            max_tokens or 0,
+        )
+        if self.cache is not None:
+            embeddings = await self.cache.get(*key, texts)
+        else:
+            embeddings = [None] * len(texts)
+        missing = list(dict.fromkeys(t for t, e in zip(texts, embeddings) if e is None))
+        if missing:
+            # batched with concurrent requests
+            computed = await entry.scheduler.embed(missing, max_tokens)
+            if dimensions:
+                computed = self.engine.truncate_dimensions(computed, dimensions)
+            if self.cache is not None:
+                self.cache.put(*key, missing, computed)
+            rows = dict(zip(missing, computed))
+            embeddings = [
+                rows[t] if e is None else e for t, e in zip(texts, embeddings)
+            ]
+        return entry.name, np.stack(embeddings)
+
+    async def health(self) -> dict:
+        loaded = self.registry.loaded if self.registry is not None else {}
+        return {
+            "inference_engine": self.engine.INFERENCE_ENGINE if self.engine else None,
+            "model_loaded": DEFAULT_MODEL in loaded,
+            "loaded_models": loaded,
+            "thread_topology": asdict(self.topology),
+            "embedding_cache": self.cache.stats() if self.cache else None,
+        }
+
+    async def metrics(self) -> dict:
+        return metrics.snapshot()
+
+
+class SocketInference:
+    """Client of the inference process"""
+
+    def __init__(
+        self,
+        path: str = INFERENCE_SOCKET,
+        connect_timeout: float = INFERENCE_CONNECT_TIMEOUT,
+    ):
+        self.path = path
+        self.connect_timeout = connect_timeout
+        self._writer = None
+        self._read_task = None
+        self._responses: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        logger.info(f"Connecting to the inference process on {self.path}...")
+        await self._connect(self.connect_timeout)
+        logger.info("Connected to the inference process")
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._read_task is not None:
+            self._read_task.cancel()
+
+    async def _connect(self, timeout: float = 0):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if loop.time() >= deadline:
+                    raise
+                await asyncio.sleep(0.5)
+        self._writer = writer
+        self._read_task = loop.create_task(self._read_responses(reader, writer))
+
+    async def _read_responses(self, reader, writer):
+        try:
+            while True:
+                header, body = await _read_frame(reader)
+                future = self._responses.pop(header["id"], None)
+                if future is not None and not future.done():
+                    future.set_result((header, body))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.warning(f"Connection to the inference process lost: {e!r}")
+        finally:
+            # the next request reconnects, the ones in flight fail
+            if self._writer is writer:
+                self._writer = None
+            writer.close()
+            for future in self._responses.values():
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError("Inference process closed the connection")
+                    )
+            self._responses.clear()
+
+    async def _request(self, header: dict) -> Tuple[dict, bytes]:
+        async with self._lock:
+            if self._writer is None:
+                await self._connect()
+            request_id = next(self._ids)
+            future = asyncio.get_running_loop().create_future()
+            self._responses[request_id] = future
+            self._writer.write(_frame({**header, "id": request_id}))
+            await self._writer.drain()
+        try:
+            response, body = await future
+        finally:
+            self._responses.pop(request_id, None)
+        if "error" in response:
+            if response.get("invalid"):
+                raise InvalidRequest(response["error"])
+            raise RuntimeError(response["error"])
+        return response, body
+
+    async def embed(
+        self,
+        model: str,
+        texts: List[str],
+        max_tokens: Optional[int] = None,
+        dimensions: Optional[int] = None,
+    ) -> Tuple[str, np.ndarray]:
+        response, body = await self._request(
+            {
+                "op": "embed",
+                "model": model,
+                "texts": texts,
+                "max_tokens": max_tokens,
+                "dimensions": dimensions,
+            }
+        )
+        embeddings = np.frombuffer(body, dtype="<f4").reshape(response["shape"])
+        return response["model"], embeddings
+
+    async def health(self) -> dict:
+        response, _ = await self._request({"op": "health"})
+        return {k: v for k, v in response.items() if k not in ("id", "nbytes")}
+
+    async def metrics(self) -> dict:
+        response, _ = await self._request({"op": "metrics"})
+        return {k: v for k, v in response.items() if k not in ("id", "nbytes")}
+
+
+class InferenceServer:
+    """Serves a LocalInference to the HTTP workers"""
+
+    def __init__(self, inference: LocalInference, path: str = INFERENCE_SOCKET):
+        self.inference = inference
+        self.path = path
+
+    async def serve_forever(self):
+        await self.inference.start()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._handle_connection, self.path)
+        logger.info(f"Inference process listening on {self.path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.inference.close()
+
+    async def _handle_connection(self, reader, writer):
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                header, _ = await _read_frame(reader)
+                # concurrent requests of a worker are batched together
+                task = asyncio.get_running_loop().create_task(
+                    self._handle_request(header, writer, write_lock)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _handle_request(self, header: dict, writer, write_lock: asyncio.Lock):
+        try:
+            response, body = await self._dispatch(header)
+        except (ModelNotAllowed, InvalidRequest) as e:
+            response, body = {"error": str(e), "invalid": True}, b""
+        except Exception as e:
+            logger.error(f"Error handling {header.get('op')} request: {e}")
+            response, body = {"error": str(e)}, b""
+        async with write_lock:
+            try:
+                writer.write(_frame({**response, "id": header["id"]}, body))
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    async def _dispatch(self, header: dict) -> Tuple[dict, bytes]:
+        op = header.get("op")
+        if op == "embed":
+            name, embeddings = await self.inference.embed(
+                header["model"],
+                header["texts"],
+                header.get("max_tokens"),
+                header.get("dimensions"),
+            )
+            embeddings = np.ascontiguousarray(embeddings, dtype="<f4")
+            return {"model": name, "shape": embeddings.shape}, embeddings.tobytes()
+        if op == "health":
+            return await self.inference.health(), b""
+        if op == "metrics":
+            return await self.inference.metrics(), b""
+        raise InvalidRequest(f"Unknown op {op!r}")
+
+
+def create_inference(mode: str = INFERENCE_MODE):
+    if mode not in MODES:
+        raise ValueError(f"Unknown inference mode {mode!r}, use one of {MODES}")
+    return SocketInference() if mode == "socket" else LocalInference()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(InferenceServer(LocalInference()).serve_forever())
@@ -0,0 +1,54 @@
+"""In-process counters and histograms, served on GET /metrics"""
+
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_histograms = {}
+
+
+class Histogram:
+    """Cumulative bucket counts, Prometheus style (`le` upper bounds)"""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "count": self.count, "sum": self.sum}
+
+
+def incr(name: str, value: int = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, value: float, buckets=(1, 2, 4, 8, 16, 32, 64, 128)):
+    """Records `value` in histogram `name`, created with `buckets` on first use"""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "histograms": {name: h.snapshot() for name, h in _histograms.items()},
+        }
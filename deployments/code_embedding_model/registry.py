@@ -0,0 +1,131 @@
+"""Loaded embedding models, bounded by memory.
+
+Only ALLOWED_MODELS can be requested. Models load lazily on first use (one
+load per model even under concurrent requests) and the least recently used
+ones are evicted once the loaded models exceed MODEL_MEMORY_BUDGET_MB. The
+default model is pinned and never evicted.
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+import numpy as np
+from batching import BatchScheduler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "Qwen/Qwen3-Embedding-0.6B")
+ALLOWED_MODELS = [
+    name.strip()
+    for name in os.getenv("ALLOWED_MODELS", DEFAULT_MODEL).split(",")
+    if name.strip()
+]
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "4096"))
+
+
+class ModelNotAllowed(Exception):
+    pass
+
+
+@dataclass
+class LoadedModel:
+    name: str
+    model: Any
+    scheduler: BatchScheduler
+    size_bytes: int
+    # requests using the model, it isn't evicted while they run
+    users: int = 0
+
+
+class ModelRegistry:
+    def __init__(
+        self,
+        load: Callable[[str], Any],
+        encode: Callable[[Any, List[str], Optional[int]], np.ndarray],
+        size_of: Callable[[Any], int],
+        allowed=ALLOWED_MODELS,
+        pinned=(DEFAULT_MODEL,),
+        memory_budget_bytes=MODEL_MEMORY_BUDGET_MB * 2**20,
+    ):
+        self.load = load
+        self.encode = encode
+        self.size_of = size_of
+        self.allowed = set(allowed) | set(pinned)
+        self.pinned = set(pinned)
+        self.memory_budget_bytes = memory_budget_bytes
+        self._models: "OrderedDict[str, LoadedModel]" = OrderedDict()
+        self._load_locks: Dict[str, asyncio.Lock] = {}
+        self._stopping = set()
+
+    @property
+    def loaded(self) -> Dict[str, int]:
+        return {name: entry.size_bytes for name, entry in self._models.items()}
+
+    async def get(self, name: str) -> LoadedModel:
+        """Returns the loaded model, loading it first if needed"""
+        if name not in self.allowed:
+            raise ModelNotAllowed(f"Model {name!r} is not allowed")
+        entry = self._models.get(name)
+        if entry is None:
+            lock = self._load_locks.setdefault(name, asyncio.Lock())
+            async with lock:
+                entry = self._models.get(name)
+                if entry is None:
+                    entry = await self._load(name)
+        self._models.move_to_end(name)
+        return entry
+
+    @asynccontextmanager
+    async def use(self, name: str):
+        """The loaded model, kept loaded until the block exits"""
+        entry = await self.get(name)
+        entry.users += 1
+        try:
+            yield entry
+        finally:
+            entry.users -= 1
+
+    async def _load(self, name: str) -> LoadedModel:
+        logger.info(f"Loading model {name}...")
+        model = await asyncio.to_thread(self.load, name)
+        scheduler = BatchScheduler(
+            lambda texts, max_tokens: self.encode(model, texts, max_tokens), name
+        )
+        scheduler.start()
+        entry = LoadedModel(name, model, scheduler, self.size_of(model))
+        self._models[name] = entry
+        metrics.incr("registry.loads")
+        logger.info(f"Loaded model {name} ({entry.size_bytes / 2**20:.0f} MiB)")
+        await self._evict(keep=name)
+        return entry
+
+    async def _evict(self, keep: str):
+        """Evicts least recently used models until the budget is met"""
+        for name in list(self._models):
+            if sum(self.loaded.values()) <= self.memory_budget_bytes:
+                break
+            if name in self.pinned or name == keep or self._models[name].users:
+                continue
+            entry = self._models.pop(name)
+            metrics.incr("registry.evictions")
+            logger.info(
+                f"Evicted model {name} ({entry.size_bytes / 2**20:.0f} MiB), "
+                f"over the {self.memory_budget_bytes / 2**20:.0f} MiB budget"
+            )
+            # requests already queued on it are still answered
+            task = asyncio.get_running_loop().create_task(
+                entry.scheduler.stop(drain=True)
+            )
+            self._stopping.add(task)
+            task.add_done_callback(self._stopping.discard)
+
+    async def close(self):
+        for entry in self._models.values():
+            await entry.scheduler.stop()
+        self._models.clear()
@@ -0,0 +1,19 @@
+#!/bin/sh
+# One inference process owns the models, the uvicorn workers only handle HTTP
+# and send it their texts over INFERENCE_SOCKET (see inference.py).
+export INFERENCE_MODE=socket
+# WORKERS_PER_CORE workers per CPU of the cgroup quota unless WORKERS is set
+WORKERS=${WORKERS:-$(python topology.py)}
+
+python inference.py &
+INFERENCE_PID=$!
+uvicorn app:app --workers "$WORKERS" --host 0.0.0.0 --port "${PORT:-7860}" &
+HTTP_PID=$!
+
+trap 'kill $INFERENCE_PID $HTTP_PID 2>/dev/null; exit 0' INT TERM
+# stop the container when either process exits
+while kill -0 $INFERENCE_PID 2>/dev/null && kill -0 $HTTP_PID 2>/dev/null; do
+    sleep 5
+done
+kill $INFERENCE_PID $HTTP_PID 2>/dev/null
+exit 1
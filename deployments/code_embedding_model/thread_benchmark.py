@@ -0,0 +1,141 @@
+"""Thread topology sweep of the embedding service.
+
+For every combination of intra-op threads, inter-op threads and workers per
+core, starts the service (serve.sh) with those settings, then sends --requests
+requests of --batch texts at each --concurrency level and prints throughput and
+latency per level, one curve per combination.
+
+The service runs with the embedding cache off (EMBEDDING_CACHE_PATH=""), the
+same texts are sent on every run and would otherwise time cache hits instead
+of inference.
+
+    python thread_benchmark.py --intra-op 1,2,4 --workers-per-core 0.5,1,2
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+TEXTS = [
+    "How do I animate a square turning into a circle?",
+    "class SquareToCircle(Scene):\n    def construct(self):\n"
+    "        self.play(Transform(Square(), Circle()))",
+    "axes = Axes(x_range=[-3, 3], y_range=[-1, 9])\n"
+    "graph = axes.plot(lambda x: x**2, color=BLUE)",
+    "Updaters are functions called every frame with the mobject and dt.",
+]
+
+
+def _percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+
+def _post(url, texts):
+    body = json.dumps({"input": texts, "encoding_format": "base64"}).encode()
+    request = urllib.request.Request(url, body, {"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=300) as resp:
+        resp.read()
+    return time.perf_counter() - start
+
+
+def _wait_healthy(base_url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The service exited during startup")
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=5) as resp:
+                health = json.load(resp)
+            if health.get("model_loaded"):
+                return health
+        except OSError:
+            pass
+        time.sleep(1)
+    raise TimeoutError(f"The service was not healthy after {timeout}s")
+
+
+def run_load(url, concurrency, requests, batch):
+    """(requests/s, latencies in s) of `requests` requests from `concurrency`
+    clients"""
+    texts = [
+        [f"{TEXTS[(i + j) % len(TEXTS)]} #{i}" for j in range(batch)]
+        for i in range(requests)
+    ]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(lambda t: _post(url, t), texts))
+    return requests / (time.perf_counter() - start), latencies
+
+
+def sweep(args):
+    base_url = f"http://127.0.0.1:{args.port}"
+    print(
+        f"{'intra':>5}{'inter':>6}{'workers':>8}{'conc':>6}"
+        f"{'req/s':>9}{'texts/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    )
+    for intra, inter, per_core in product(
+        args.intra_op, args.inter_op, args.workers_per_core
+    ):
+        env = {
+            **os.environ,
+            "INTRA_OP_THREADS": str(intra),
+            "INTER_OP_THREADS": str(inter),
+            "WORKERS_PER_CORE": str(per_core),
+            "PORT": str(args.port),
+            # every run sends the same texts, measure inference not cache hits
+            "EMBEDDING_CACHE_PATH": "",
+        }
+        env.pop("WORKERS", None)
+        process = subprocess.Popen(
+            ["sh", "serve.sh"], env=env, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        try:
+            health = _wait_healthy(base_url, process, args.startup_timeout)
+            workers = health["thread_topology"]["workers"]
+            url = f"{base_url}/v1/embeddings"
+            run_load(url, max(args.concurrency), args.warmup, args.batch)
+            for concurrency in args.concurrency:
+                throughput, latencies = run_load(
+                    url, concurrency, args.requests, args.batch
+                )
+                print(
+                    f"{intra:>5}{inter:>6}{workers:>8}{concurrency:>6}"
+                    f"{throughput:>9.1f}{throughput * args.batch:>9.1f}"
+                    f"{_percentile(latencies, 0.50) * 1000:>9.1f}"
+                    f"{_percentile(latencies, 0.95) * 1000:>9.1f}"
+                    f"{_percentile(latencies, 0.99) * 1000:>9.1f}",
+                    flush=True,
+                )
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+
+
+def _ints(value):
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--intra-op", type=_ints, default=[1, 2, 4])
+    parser.add_argument("--inter-op", type=_ints, default=[1])
+    parser.add_argument(
+        "--workers-per-core",
+        type=lambda v: [float(x) for x in v.split(",")],
+        default=[0.5, 1, 2],
+    )
+    parser.add_argument("--concurrency", type=_ints, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--warmup", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=8, help="texts per request")
+    parser.add_argument("--port", type=int, default=7861)
+    parser.add_argument("--startup-timeout", type=float, default=900)
+    sweep(parser.parse_args())
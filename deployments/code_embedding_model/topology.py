@@ -0,0 +1,83 @@
+"""CPU thread topology of the service.
+
+Unset settings are derived from the CPU quota of the container's cgroup (or
+the CPUs the process may run on without one). serve.sh starts WORKERS_PER_CORE
+uvicorn workers per CPU. The process running the model gets one intra-op thread
+per CPU and a single inter-op thread, since the batch scheduler runs one encode
+at a time. With INFERENCE_MODE=local every worker runs its own model, so the
+CPUs are split between the workers instead of being oversubscribed.
+
+    python topology.py  # prints the number of workers, for serve.sh
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+# 0 derives the value from the CPUs
+INTRA_OP_THREADS = int(os.getenv("INTRA_OP_THREADS") or 0)
+INTER_OP_THREADS = int(os.getenv("INTER_OP_THREADS") or 0)
+WORKERS = int(os.getenv("WORKERS") or 0)
+WORKERS_PER_CORE = float(os.getenv("WORKERS_PER_CORE", "1"))
+
+
+@dataclass
+class ThreadTopology:
+    cpus: int
+    cpu_quota: Optional[float]
+    workers: int
+    intra_op_threads: int
+    inter_op_threads: int
+
+    def export_env(self):
+        """Sizes the OpenMP/MKL and tokenizer thread pools, must run before
+        torch and tokenizers are imported"""
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "RAYON_RS_NUM_CPUS"):
+            os.environ.setdefault(name, str(self.intra_op_threads))
+
+
+def cpu_quota() -> Optional[float]:
+    """CPUs allowed by the cgroup (v2, then v1) CPU quota, None if unlimited"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus(quota: Optional[float]) -> int:
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    if quota is not None:
+        # rounded down, threads beyond the quota only get throttled
+        cpus = min(cpus, max(1, int(quota)))
+    return cpus
+
+
+def thread_topology(inference_mode: str = "local") -> ThreadTopology:
+    quota = cpu_quota()
+    cpus = available_cpus(quota)
+    workers = WORKERS or max(1, round(cpus * WORKERS_PER_CORE))
+    model_processes = 1 if inference_mode == "socket" else workers
+    return ThreadTopology(
+        cpus=cpus,
+        cpu_quota=quota,
+        workers=workers,
+        intra_op_threads=INTRA_OP_THREADS or max(1, cpus // model_processes),
+        inter_op_threads=INTER_OP_THREADS or 1,
+    )
+
+
+if __name__ == "__main__":
+    print(thread_topology(os.getenv("INFERENCE_MODE", "local")).workers)